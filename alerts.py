@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import logging
+import math
+import sqlite3
+import time
+from collections import namedtuple
+
+from store import DebouncedWriter
+
+logger = logging.getLogger(__name__)
+
+# Metric name in /alert -> (title, number format)
+METRICS = {
+    "price": ("XSG Price", lambda v: f"{v:1.4f}$"),
+    "mn": ("Active Masternodes", lambda v: f"{v:1.0f}"),
+    "hashrate": ("Network Hashrate", lambda v: f"{v/1000:1.2f} kSol/s"),
+    "difficulty": ("Network Difficulty", lambda v: f"{v:1.3f}"),
+}
+OPERATORS = (">", "<")
+
+Alert = namedtuple("Alert", "id chat_id metric op threshold")
+
+
+def parse_alert(args):
+    # ["price", ">", "0.02"] or ["price>0.02"] -> (metric, op, threshold), None if it is not one
+    text = "".join(args).lower().rstrip("$")
+    for op in OPERATORS:
+        metric, found, threshold = text.partition(op)
+        if found and metric in METRICS:
+            try:
+                threshold = float(threshold)
+            except ValueError:
+                return None
+            return (metric, op, threshold) if math.isfinite(threshold) else None
+    return None
+
+
+def holds(op, value, threshold):
+    return value > threshold if op == ">" else value < threshold
+
+
+class AlertBook:
+    # One-shot alerts on the metrics in METRICS, plus the chats that get a daily digest. Alerts are
+    # indexed as sorted (threshold, id) lists per metric and direction, so a new value only looks
+    # at the thresholds it crossed since the previous one. The last values are stored too, so
+    # crossings while the bot was down still fire after a restart. Changes apply in memory right
+    # away and are written to sqlite later, batched by a DebouncedWriter. Everything else runs on
+    # the loop.
+
+    def __init__(self, path="alerts.db", debounce=5):
+        self.path = path
+        # Last value seen of every metric
+        self.values = {}
+        # chat id -> UTC hour of its digest
+        self.digests = {}
+        self._alerts = {}
+        self._index = {(metric, op): [] for metric in METRICS for op in OPERATORS}
+        self._next_id = 1
+        # Changes are (sql statement, args)
+        self._writer = DebouncedWriter(self._flush, debounce)
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS alerts "
+                "(id INTEGER PRIMARY KEY, chat_id INTEGER, metric TEXT, op TEXT, threshold REAL)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS digests (chat_id INTEGER PRIMARY KEY, hour INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS metric_values (metric TEXT PRIMARY KEY, value REAL)")
+        return self._db
+
+    def load(self):
+        try:
+            with self._writer.io_lock:
+                db = self._connect()
+                alerts = db.execute("SELECT id, chat_id, metric, op, threshold FROM alerts").fetchall()
+                digests = db.execute("SELECT chat_id, hour FROM digests").fetchall()
+                values = db.execute("SELECT metric, value FROM metric_values").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Loading the alerts failed: {e!r}")
+            return
+        for row in alerts:
+            alert = Alert(*row)
+            if (alert.metric, alert.op) in self._index:
+                self._insert(alert)
+            self._next_id = max(self._next_id, alert.id + 1)
+        self.digests = dict(digests)
+        self.values = {metric: value for metric, value in values if metric in METRICS}
+
+    def _write(self, statement, args):
+        self._writer.add((statement, args))
+
+    def _flush(self, changes):
+        try:
+            with self._connect() as db:
+                for statement, args in changes:
+                    db.execute(statement, args)
+        except sqlite3.Error as e:
+            logger.warning(f"Saving the alerts failed: {e!r}")
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        with self._writer.io_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _insert(self, alert):
+        self._alerts[alert.id] = alert
+        bisect.insort(self._index[(alert.metric, alert.op)], (alert.threshold, alert.id))
+
+    def add(self, chat_id, metric, op, threshold):
+        alert = Alert(self._next_id, chat_id, metric, op, threshold)
+        self._next_id += 1
+        self._insert(alert)
+        self._write("INSERT INTO alerts VALUES (?, ?, ?, ?, ?)", tuple(alert))
+        return alert
+
+    def remove(self, alert_id, chat_id=None):
+        alert = self._alerts.get(alert_id)
+        if alert is None or (chat_id is not None and alert.chat_id != chat_id):
+            return None
+        del self._alerts[alert_id]
+        entries = self._index[(alert.metric, alert.op)]
+        del entries[bisect.bisect_left(entries, (alert.threshold, alert.id))]
+        self._write("DELETE FROM alerts WHERE id = ?", (alert_id,))
+        return alert
+
+    def of_chat(self, chat_id):
+        return sorted((alert for alert in self._alerts.values() if alert.chat_id == chat_id), key=lambda a: a.id)
+
+    def set_digest(self, chat_id, hour):
+        # `hour` None unsubscribes
+        if hour is None:
+            self.digests.pop(chat_id, None)
+            self._write("DELETE FROM digests WHERE chat_id = ?", (chat_id,))
+        else:
+            self.digests[chat_id] = hour
+            self._write("INSERT OR REPLACE INTO digests VALUES (?, ?)", (chat_id, hour))
+
+    def _fire(self, entries, first, last):
+        fired = [self._alerts.pop(alert_id) for _, alert_id in entries[first:last]]
+        del entries[first:last]
+        for alert in fired:
+            self._write("DELETE FROM alerts WHERE id = ?", (alert.id,))
+        return fired
+
+    def observe(self, metric, value):
+        # Record the metric's new value; returns the alerts it set off, which are removed
+        previous = self.values.get(metric)
+        if value == previous:
+            return []
+        self.values[metric] = value
+        self._write("INSERT OR REPLACE INTO metric_values VALUES (?, ?)", (metric, value))
+        above = self._index[(metric, ">")]
+        below = self._index[(metric, "<")]
+        if previous is None:
+            # Nothing to cross from yet: fire every alert whose condition already holds
+            return self._fire(above, 0, bisect.bisect_left(above, (value,))) + self._fire(
+                below, bisect.bisect_right(below, (value, math.inf)), len(below)
+            )
+        if value > previous:
+            # Crossed on the way up: previous <= threshold < value
+            return self._fire(above, bisect.bisect_left(above, (previous,)), bisect.bisect_left(above, (value,)))
+        # On the way down: value < threshold <= previous
+        return self._fire(
+            below, bisect.bisect_right(below, (value, math.inf)), bisect.bisect_right(below, (previous, math.inf))
+        )
+
+    def due_digests(self, hour):
+        return [chat_id for chat_id, digest_hour in self.digests.items() if digest_hour == hour]
+
+    def stats(self):
+        return {"alerts": len(self._alerts), "digests": len(self.digests)}
+
+
+class Notifier:
+    # Queue of messages to chats that did not just send a command (alerts, digests). A worker sends
+    # them in batches: whatever is queued within `window` seconds is merged into one message per
+    # chat, and every message waits for the tenant's per-chat and global rate limits rather than
+    # being dropped. `send` is the blocking telegram call, run with `run_sync`.
+
+    def __init__(self, limiter, send, run_sync, window=1.0, max_length=4096):
+        self.limiter = limiter
+        self.send = send
+        self.run_sync = run_sync
+        self.window = window
+        self.max_length = max_length
+        self.counts = {"queued": 0, "sent": 0, "failed": 0}
+        self.loop = None
+        self._queue = None
+        self._worker = None
+
+    def start(self, loop):
+        self.loop = loop
+        asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+
+    async def _start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._work())
+
+    def notify(self, chat_id, message):
+        # On the loop
+        self.counts["queued"] += 1
+        self._queue.put_nowait((chat_id, message))
+
+    def batch(self, items):
+        # [(chat id, message)] -> {chat id: [merged message]}, keeping every merged one under
+        # telegram's message size limit
+        batches = {}
+        for chat_id, message in items:
+            messages = batches.setdefault(chat_id, [])
+            if messages and len(messages[-1]) + len(message) + 2 <= self.max_length:
+                messages[-1] = f"{messages[-1]}\n\n{message}"
+            else:
+                messages.append(message)
+        return batches
+
+    async def _work(self):
+        while True:
+            items = [await self._queue.get()]
+            await asyncio.sleep(self.window)
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            for chat_id, messages in self.batch(items).items():
+                for message in messages:
+                    await self._send(chat_id, message)
+
+    async def _send(self, chat_id, message):
+        await self.limiter.acquire(chat_id, max_wait=math.inf)
+        try:
+            await self.run_sync(self.send, chat_id, message)
+            self.counts["sent"] += 1
+        except Exception as e:
+            # Blocked bots, deleted chats and the like; the alert is gone either way
+            self.counts["failed"] += 1
+            logger.warning(f"Notifying chat {chat_id} failed: {e!r}")
+
+    def stop(self):
+        if self._worker is not None:
+            self.loop.call_soon_threadsafe(self._worker.cancel)
+
+
+def seconds_to_next_hour(now=None):
+    now = time.time() if now is None else now
+    return 3600 - now % 3600
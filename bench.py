@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# Offline benchmark: runs the bot's handlers against a local stand-in for every upstream api,
+# serving the payloads recorded in fixtures/upstream, and replays bursts of fake telegram updates, e.g.
+#   python bench.py --bursts 20 --burst-size 50 --chats 200 --latency 80 --error-rate 0.02
+# Save a run with --save and check later ones against it with --compare; a regression exits with 1.
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+import bot
+from config import Settings, read_json, validate
+from scheduler import freeze
+from tenant import Tenant
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(ROOT, "fixtures", "upstream")
+# links.json entry -> stand-in route
+SOURCES = {
+    "blocks_info": "/blocks_info",
+    "net_status": "/net_status",
+    "rates": "/rates",
+    "masternodes.link": "/masternodes",
+    "masternodes.asgard_managed": "/asgard_managed",
+}
+# Command text -> handler; the mix a burst is drawn from
+COMMANDS = {
+    "/coin": bot.coin_info,
+    "/mn": bot.mninfo,
+    "/market info": bot.market_info,
+    "/calc 25000": bot.calc,
+}
+# Sources that can have mirrors, served again under /mirror
+MIRRORED = ("blocks_info", "net_status", "rates")
+ERROR_REPLY = "There was an error with"
+TIMEOUT_REPLY = "The upstream apis are slow"
+STALE_REPLY = "is not responding, this uses data from"
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as data_file:
+        return json.load(data_file)
+
+
+def masternode_list(count):
+    # Copies of the recorded entries with unique outpoints, about 400 bytes per node
+    recorded = load_fixture("masternodes.json")
+    nodes = []
+    for rank in range(1, count + 1):
+        node = dict(recorded[rank % len(recorded)], rank=rank, outidx=rank % 8)
+        node["txhash"] = f"{rank:064x}"
+        nodes.append(node)
+    return json.dumps(nodes, indent=2).encode()
+
+
+class StandIn:
+    # Serves the recorded payloads with injected latency, errors and hanging requests, and counts
+    # the requests per route.
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, timeout_rate=0, hang=60, masternodes=12000, seed=0):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.bytes = 0
+        self.blocks = load_fixture("blocks.json")
+        self.bodies = {
+            "/net_status": json.dumps(load_fixture("status.json")).encode(),
+            "/rates": json.dumps(load_fixture("rates.json")).encode(),
+            "/masternodes": masternode_list(masternodes),
+            "/asgard_managed": json.dumps(load_fixture("asgard_managed.json")).encode(),
+        }
+        for exchange in ("stex", "mercatox", "graviex"):
+            self.bodies[f"/markets/{exchange}"] = json.dumps(load_fixture(f"{exchange}.json")).encode()
+        self.started = time.time()
+
+    def blocks_body(self, limit):
+        # The chain moves on while the benchmark runs: a block every minute since the stand-in started
+        template = self.blocks["blocks"][0]
+        tip = template["height"] + int(time.time() - self.started) // 60
+        now = int(time.time())
+        blocks = [
+            dict(template, height=tip - i, time=now - 60 * i, hash=f"{tip - i:064x}") for i in range(min(limit, 2048))
+        ]
+        return json.dumps(dict(self.blocks, blocks=blocks, length=len(blocks))).encode()
+
+    async def handle(self, request):
+        self.counts[request.path] += 1
+        delay = max(0, self.random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        if self.random.random() < self.timeout_rate:
+            delay = self.hang
+        await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            return web.Response(status=502, text="Bad Gateway")
+        path = request.path[len("/mirror") :] if request.path.startswith("/mirror/") else request.path
+        if path == "/blocks_info":
+            body = self.blocks_body(int(request.query.get("limit", 10)))
+        else:
+            body = self.bodies[path]
+        self.bytes += len(body)
+        return web.Response(body=body, content_type="application/json")
+
+    async def stats(self, request):
+        return web.json_response({"requests": dict(self.counts), "bytes": self.bytes})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/_stats", self.stats)
+        for path in list(self.bodies) + ["/blocks_info"]:
+            app.router.add_get(path, self.handle)
+        for name in MIRRORED:
+            app.router.add_get("/mirror" + SOURCES[name], self.handle)
+        return app
+
+
+def serve(port, options):
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+    web.run_app(StandIn(**options).app(), host="127.0.0.1", port=port, print=None)
+
+
+def bench_settings(directory, base, unlimited=False, mirrors=False):
+    # The settings in `directory` with every upstream url pointing at the stand-in
+    links = read_json(os.path.join(directory, "links.json"))
+    params = read_json(os.path.join(directory, "params.json"))
+    markets = read_json(os.path.join(directory, "market.json"))
+    for name, path in SOURCES.items():
+        section, _, key = name.rpartition(".")
+        (links[section] if section else links)[key] = base + path + ("?limit=101" if name == "blocks_info" else "")
+    links["mirrors"] = {}
+    if mirrors:
+        for name in MIRRORED:
+            links["mirrors"][name] = [
+                base + "/mirror" + SOURCES[name] + ("?limit=101" if name == "blocks_info" else "")
+            ]
+    for market in markets:
+        market["api"] = f"{base}/markets/{market['exchange']}"
+    if unlimited:
+        # Measure the handlers only, without telegram's rate limits
+        params["rate_limit"] = dict(params.get("rate_limit", {}), global_rate=1e6, chat_rate=1e6, chat_burst=1e6)
+        params["rate_limit"].update(user_rate=1e6, user_burst=1e6, coalesce_window=0)
+    validate(links, params, markets)
+    return Settings(freeze(links), freeze(params), freeze(markets))
+
+
+def fake_update(update_id, chat_id, text, replies):
+    # Just enough of a telegram Update for the handlers; reply_text records when the reply was sent
+    def reply_text(message, **kwargs):
+        replies[update_id] = (time.monotonic(), message)
+
+    message = SimpleNamespace(message_id=update_id, text=text, reply_text=reply_text)
+    chat = SimpleNamespace(id=chat_id)
+    update = SimpleNamespace(update_id=update_id, message=message, effective_chat=chat, effective_user=chat)
+    return update, SimpleNamespace(args=text.split()[1:], error=None)
+
+
+def fake_updates(bursts, burst_size, chats, rng):
+    # [[(update_id, chat_id, command text)]], one list per burst
+    update_id = 0
+    result = []
+    for _ in range(bursts):
+        burst = []
+        for _ in range(burst_size):
+            update_id += 1
+            burst.append((update_id, -1_000_000_000_000 - rng.randrange(chats), rng.choice(list(COMMANDS))))
+        result.append(burst)
+    return result
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else None
+
+
+def run(args, base):
+    with tempfile.TemporaryDirectory() as work:
+        settings = bench_settings(ROOT, base, unlimited=args.unlimited, mirrors=args.mirrors)
+        # market.json, history.db and the time series are written in a scratch directory
+        tenant = Tenant("bench", work, {"token": "bench"}, settings)
+        bot.setup([tenant])
+        bot.pipeline.on_error = bot.error
+        bot.client.start()
+        bot.pipeline.start(bot.client.loop)
+        if not args.cold:
+            bot.start_refresher()
+            time.sleep(args.warmup)
+
+        submit = {text: bot.handle(callback, tenant) for text, callback in COMMANDS.items()}
+        replies = {}
+        sent = {}
+        start = time.monotonic()
+        for burst in fake_updates(args.bursts, args.burst_size, args.chats, random.Random(args.seed)):
+            for update_id, chat_id, text in burst:
+                update, context = fake_update(update_id, chat_id, text, replies)
+                sent[update_id] = (time.monotonic(), text)
+                submit[text](update, context)
+            time.sleep(args.gap)
+        bot.client.run(bot.pipeline.drain(args.drain))
+        # Replies are sent from the pipeline's threads; give the last ones a moment to land
+        time.sleep(0.2)
+        elapsed = (max((at for at, _ in replies.values()), default=start) - start) or 1e-9
+
+        latencies = sorted(replies[update_id][0] - sent[update_id][0] for update_id in replies)
+        by_command = {}
+        for text in COMMANDS:
+            ordered = sorted(replies[i][0] - sent[i][0] for i in replies if sent[i][1] == text)
+            by_command[text] = {
+                "count": len(ordered),
+                "p50": percentile(ordered, 0.5),
+                "p95": percentile(ordered, 0.95),
+            }
+        upstream = bot.client.run(bot.client.fetch(base + "/_stats")) or {"requests": {}, "bytes": 0}
+        result = {
+            "updates": len(sent),
+            "replies": len(replies),
+            "error_replies": sum(message.startswith(ERROR_REPLY) for _, message in replies.values()),
+            "timeout_replies": sum(message.startswith(TIMEOUT_REPLY) for _, message in replies.values()),
+            "stale_replies": sum(STALE_REPLY in message for _, message in replies.values()),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "updates_per_s": len(replies) / elapsed,
+            "upstream_requests": sum(upstream["requests"].values()),
+            "upstream_bytes": upstream["bytes"],
+            # kilobytes on linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "commands": by_command,
+            "upstream": upstream["requests"],
+            "rate_limit": tenant.limiter.stats(),
+            "cache": bot.cache.stats(),
+        }
+        bot.pipeline.stop(args.drain)
+        bot.refresher.stop()
+        bot.client.close()
+        tenant.market_store.close()
+    return result
+
+
+def ms(value):
+    return "-" if value is None else f"{value * 1000:.1f} ms"
+
+
+def report(result):
+    print(
+        f"{result['updates']} updates, {result['replies']} replies ({result['error_replies']} upstream errors,"
+        + f" {result['stale_replies']} stale, {result['timeout_replies']} deadline misses),"
+        + f" {result['updates_per_s']:.1f} updates/s"
+    )
+    print(f"Reply latency: p50 {ms(result['p50'])}, p95 {ms(result['p95'])}, p99 {ms(result['p99'])}")
+    for text, stats in result["commands"].items():
+        print(f"  {text:<14} {stats['count']:>6} replies, p50 {ms(stats['p50'])}, p95 {ms(stats['p95'])}")
+    print(
+        f"Upstream: {result['upstream_requests']} requests, {result['upstream_bytes'] / 1e6:.1f} MB"
+        + f" {result['upstream']}"
+    )
+    print(f"Rate limit: {result['rate_limit']}")
+    print(f"Peak RSS: {result['peak_rss_mb']:.1f} MB")
+
+
+def regressions(result, baseline, tolerance):
+    # Metrics that got worse than the baseline by more than `tolerance` (a fraction)
+    worse = []
+    for key in ("p50", "p95", "p99", "upstream_requests", "peak_rss_mb"):
+        if result[key] is not None and baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            worse.append(f"{key} {baseline[key]:.4g} -> {result[key]:.4g}")
+    if baseline.get("updates_per_s") and result["updates_per_s"] < baseline["updates_per_s"] * (1 - tolerance):
+        worse.append(f"updates_per_s {baseline['updates_per_s']:.4g} -> {result['updates_per_s']:.4g}")
+    return worse
+
+
+def wait_for_server(base, timeout=30):
+    async def ready():
+        end = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.get(base + "/_stats") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    if time.monotonic() > end:
+                        raise
+                await asyncio.sleep(0.1)
+
+    asyncio.run(ready())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers against recorded upstream payloads")
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--burst-size", type=int, default=50, help="updates per burst")
+    parser.add_argument("--gap", type=float, default=1, help="seconds between bursts")
+    parser.add_argument("--chats", type=int, default=100, help="spread the updates over this many chats")
+    parser.add_argument("--latency", type=float, default=50, help="upstream latency in ms")
+    parser.add_argument("--jitter", type=float, default=20, help="standard deviation of the latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of upstream requests answered with 502")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="fraction of upstream requests that hang")
+    parser.add_argument("--hang", type=float, default=60, help="seconds a hanging request takes")
+    parser.add_argument("--masternodes", type=int, default=12000, help="size of the masternode list")
+    parser.add_argument("--mirrors", action="store_true", help="give the explorer and rates sources a mirror each")
+    parser.add_argument("--cold", action="store_true", help="do not start the refresher; serve through the cache")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds for the refresher to fill its snapshots")
+    parser.add_argument("--unlimited", action="store_true", help="lift the telegram rate limits and coalescing")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for the last replies")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="json file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "timeout_rate": args.timeout_rate,
+        "hang": args.hang,
+        "masternodes": args.masternodes,
+        "seed": args.seed,
+    }
+    # The stand-in runs in its own process, so it neither competes for the bot's loop nor counts in its RSS
+    server = multiprocessing.Process(target=serve, args=(args.port, options), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_for_server(base)
+        result = run(args, base)
+    finally:
+        server.terminate()
+    report(result)
+    if args.save:
+        with open(args.save, "w") as data_file:
+            json.dump(result, data_file, indent=2)
+    if args.compare:
+        with open(args.compare) as data_file:
+            worse = regressions(result, json.load(data_file), args.tolerance)
+        if worse:
+            print(f"Regressions against {args.compare}: {'; '.join(worse)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import logging
+import time
+from array import array
+from collections import namedtuple
+from types import MappingProxyType
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+BlockStats = namedtuple("BlockStats", ["height", "time", "avg_bt", "windows", "p50", "p90"])
+
+# Block time used when there are not enough blocks to measure one
+DEFAULT_BLOCK_TIME = 60
+
+
+class BlockWindow:
+    # Fixed-size ring buffer of the most recent blocks (height, time, hash), oldest first.
+
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.heights = array("q", [0] * capacity)
+        self.times = array("q", [0] * capacity)
+        self.hashes = [None] * capacity
+        self.start = 0
+        self.count = 0
+
+    def _index(self, i):
+        # Ring position of the i-th block, counting from the oldest one (negative counts from the tip)
+        if i < 0:
+            i += self.count
+        return (self.start + i) % self.capacity
+
+    def height(self, i=-1):
+        return self.heights[self._index(i)]
+
+    def time(self, i=-1):
+        return self.times[self._index(i)]
+
+    def hash(self, i=-1):
+        return self.hashes[self._index(i)]
+
+    @property
+    def tip(self):
+        return self.height() if self.count else None
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def truncate(self, height):
+        # Drop every block above `height`
+        while self.count and self.height() > height:
+            self.count -= 1
+
+    def append(self, height, time, hash):
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+        i = self._index(self.count)
+        self.heights[i] = height
+        self.times[i] = time
+        self.hashes[i] = hash
+        self.count += 1
+
+    def extend(self, blocks):
+        # Merge explorer blocks (any order) into the window. Returns False when the batch does not
+        # connect to the tip, i.e. more blocks are needed to fill the gap.
+        blocks = sorted(blocks, key=lambda b: b["height"])
+        if not blocks:
+            return True
+        if self.count and blocks[0]["height"] > self.tip + 1:
+            return False
+        for block in blocks:
+            height = block["height"]
+            if self.count and height <= self.tip:
+                offset = height - self.height(0)
+                if offset < 0 or self.hash(offset) == block["hash"]:
+                    continue
+                logger.warning(f"Reorg detected at height {height}.")
+                self.truncate(height - 1)
+            if self.count and height != self.tip + 1:
+                continue
+            self.append(height, block["time"], block["hash"])
+        return True
+
+    def avg_block_time(self, blocks):
+        # Average time of the last `blocks` blocks, O(1)
+        blocks = min(blocks, self.count - 1)
+        if blocks < 1:
+            return DEFAULT_BLOCK_TIME
+        return (self.time() - self.time(-1 - blocks)) / blocks
+
+    def blocks_since(self, timestamp):
+        # Number of blocks newer than `timestamp`, by binary search over the ring
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time(mid) <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.count - lo
+
+    def avg_over(self, seconds):
+        return self.avg_block_time(self.blocks_since(self.time() - seconds))
+
+    def percentile(self, percent, blocks):
+        blocks = min(blocks, self.count - 1)
+        if blocks < 1:
+            return DEFAULT_BLOCK_TIME
+        intervals = sorted(self.time(i) - self.time(i - 1) for i in range(self.count - blocks, self.count))
+        return intervals[min(len(intervals) - 1, int(len(intervals) * percent / 100))]
+
+
+def with_limit(url, limit):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    query["limit"] = [str(limit)]
+    return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+
+class BlockTracker:
+    # Keeps a BlockWindow in sync with the explorer's /api/blocks, asking only for the blocks
+    # expected since the last poll plus a small overlap used to detect reorgs.
+
+    def __init__(self, client, capacity=2048, blocks=100, windows=None, overlap=3):
+        self.client = client
+        self.window = BlockWindow(capacity)
+        self.blocks = blocks
+        self.windows = dict(windows or {"1h": 3600, "24h": 86400})
+        self.overlap = overlap
+
+    def _limit(self):
+        if not self.window.count:
+            return self.window.capacity
+        elapsed = time.time() - self.window.time()
+        return int(elapsed / self.window.avg_block_time(self.blocks)) + self.overlap
+
+    async def fetch(self, url):
+        limit = self._limit()
+        for _ in range(2):
+            payload = await self.client.fetch(with_limit(url, min(limit, self.window.capacity)))
+            if payload is None or not payload.get("blocks"):
+                return None
+            if self.window.extend(payload["blocks"]):
+                return self.stats()
+            # The batch did not reach back to our tip, ask again for everything since then
+            limit = max(block["height"] for block in payload["blocks"]) - self.window.tip + self.overlap
+        self.window.clear()
+        self.window.extend(payload["blocks"])
+        return self.stats()
+
+    def stats(self):
+        window = self.window
+        return BlockStats(
+            window.tip,
+            window.time(),
+            window.avg_block_time(self.blocks),
+            MappingProxyType({name: window.avg_over(seconds) for name, seconds in self.windows.items()}),
+            window.percentile(50, self.blocks),
+            window.percentile(90, self.blocks),
+        )
@@ -2,23 +2,54 @@
 # Works with Python 3.7
 
 import asyncio
-import json
+import contextvars
+import functools
 import logging
+import re
+import signal
+import threading
+import time
+from urllib.parse import urlsplit
 
-import aiohttp
 from telegram import ParseMode
 from telegram.ext import CommandHandler, Updater
 
-with open("auth.json") as data_file:
-    auth = json.load(data_file)
-with open("links.json") as data_file:
-    data = json.load(data_file)
-with open("params.json") as data_file:
-    params = json.load(data_file)
-with open("market.json") as data_file:
-    markets = json.load(data_file)
+import alerts
+import emission
+import exchanges
+from blocks import BlockTracker
+from cache import Cache
+from config import ConfigWatcher
+from http_client import HttpClient
+from masternodes import MasternodeList
+from metrics import SIZE_BUCKETS, Metrics, MetricsServer
+from pipeline import Pipeline
+from profiler import Sampler, parse_duration
+from scheduler import Refresher
+from tenant import load_tenants
+from timeseries import parse_period
+from upstream import Upstreams
+from webhook import WebhookServer
 
-TOKEN = auth["token"]
+# The bots served by this process (tenant.Tenant), each with its own token, config and state.
+# Process-wide settings (http, pipeline, resilience, metrics, webhook, profile) come from the
+# first tenant's params.json.
+tenants = []
+# The tenant whose command is running
+current = contextvars.ContextVar("tenant")
+
+# Components built by setup(), shared by every tenant. Upstream state is keyed by url, so tenants
+# polling the same api share its connections, cache entry and refresher snapshot.
+cache = client = pipeline = refresher = metrics = send_seconds = profiler = upstreams = None
+# url -> fetch coroutine for sources that need more than a plain json fetch
+fetchers = {}
+# url -> the url followed by its mirrors
+mirrors = {}
+# url -> MasternodeList / BlockTracker, kept across config reloads so their state survives
+mn_lists = {}
+block_trackers = {}
+# Source name -> age in seconds of the stale data the current command was answered with
+stale_sources = contextvars.ContextVar("stale_sources", default=None)
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,274 +63,725 @@ def is_number(s):
         return False
 
 
-async def fetch(session, url):
-    try:
-        async with session.get(url) as response:
-            return await response.json(content_type=None)
-    except Exception:
-        return None
+def setup(new_tenants):
+    # Build the shared components for the tenants. This does no I/O, so tests and benchmarks can
+    # call it with their own tenants.
+    global tenants, cache, client, pipeline, refresher, metrics, profiler, upstreams
+    tenants = list(new_tenants)
+    params = tenants[0].params
+
+    cache = Cache()
+    http_params = params.get("http", {})
+    client = HttpClient(
+        limit=http_params.get("limit", 100),
+        limit_per_host=http_params.get("limit_per_host", 8),
+        dns_ttl=http_params.get("dns_ttl", 300),
+        timeout=http_params.get("timeout", 10),
+        timeouts={
+            tenant.source_url(name): timeout
+            for tenant in tenants
+            for name, timeout in tenant.params.get("http", {}).get("timeouts", {}).items()
+        },
+    )
+    pipeline_params = params.get("pipeline", {})
+    pipeline = Pipeline(
+        concurrency=pipeline_params.get("concurrency", 16),
+        deadline=pipeline_params.get("deadline", 20),
+        deadlines=pipeline_params.get("deadlines"),
+    )
+    resilience = params.get("resilience", {})
+    upstreams = Upstreams(
+        threshold=resilience.get("failure_threshold", 5),
+        cooldown=resilience.get("cooldown", 30),
+        hedge_after=resilience.get("hedge_after", 1.0),
+    )
+    refresher = Refresher(client.fetch)
+    refresher.listeners.append(record_sample)
+    refresher.listeners.append(record_markets)
+    refresher.listeners.append(check_alerts)
+    mn_lists.clear()
+    block_trackers.clear()
+    share_sources()
+    profile_params = params.get("profile", {})
+    profiler = Sampler(profile_params.get("path", "profiles"), profile_params.get("interval", 0.005))
+    metrics = Metrics()
+    instrument()
+
+
+def upstream_name(url):
+    # Metric label for an upstream url: host and path, without the query
+    parts = urlsplit(url)
+    return parts.netloc + parts.path
+
+
+def instrument():
+    # Feed the components' hooks and counters into the metrics registry
+    global send_seconds
+    handler_seconds = metrics.histogram("handler_seconds", "Time from receiving a command to finishing its handler.")
+    upstream_seconds = metrics.histogram("upstream_seconds", "Upstream request latency by status.")
+    upstream_bytes = metrics.histogram("upstream_bytes", "Upstream payload size.", SIZE_BUCKETS)
+    decode_seconds = metrics.histogram("upstream_decode_seconds", "Time spent decoding upstream payloads.")
+    send_seconds = metrics.histogram("telegram_send_seconds", "Latency of sending a reply to telegram.")
+
+    def on_done(name, seconds, outcome):
+        handler_seconds.labels(command=name, outcome=outcome).observe(seconds)
+
+    def on_fetch(url, status, seconds, size, decode):
+        upstream = upstream_name(url)
+        upstream_seconds.labels(upstream=upstream, status=status).observe(seconds)
+        if size:
+            upstream_bytes.labels(upstream=upstream).observe(size)
+        if decode is not None:
+            decode_seconds.labels(upstream=upstream).observe(decode)
+
+    def cache_requests():
+        return {
+            (("key", upstream_name(key)), ("result", result)): stats[result]
+            for key, stats in cache.stats().items()
+            for result in ("hits", "misses", "collapsed", "stale")
+        }
+
+    def replies():
+        return {
+            (("tenant", tenant.name), ("result", result)): count
+            for tenant in tenants
+            for result, count in tenant.limiter.counts.items()
+        }
+
+    def subscriptions():
+        return {
+            (("tenant", tenant.name), ("kind", kind)): count
+            for tenant in tenants
+            for kind, count in tenant.alerts.stats().items()
+        }
+
+    def notifications():
+        return {
+            (("tenant", tenant.name), ("result", result)): count
+            for tenant in tenants
+            if tenant.notifier is not None
+            for result, count in tenant.notifier.counts.items()
+        }
+
+    def circuits():
+        return {(("url", url),): int(state == "open") for url, state in upstreams.stats().items()}
+
+    def queue():
+        stats = pipeline.stats()
+        return {(("state", "queued"),): stats["queued"], (("state", "running"),): stats["running"]}
+
+    pipeline.on_done = on_done
+    client.on_fetch = on_fetch
+    metrics.collected("cache_requests", "counter", "Cache lookups by upstream and result.", cache_requests)
+    metrics.collected("replies", "counter", "Replies by tenant and rate limiter outcome.", replies)
+    metrics.collected("alert_subscriptions", "gauge", "Alerts and daily digests set up.", subscriptions)
+    metrics.collected("notifications", "counter", "Alert and digest messages by result.", notifications)
+    metrics.collected("upstream_circuit_open", "gauge", "1 while the url's circuit breaker is open.", circuits)
+    metrics.collected("pipeline_jobs", "gauge", "Commands waiting for or running on the pipeline.", queue)
+
+
+def shared_sources():
+    # url -> refresh interval of everything the refresher polls, the shortest any tenant asks for
+    sources = {}
+    for tenant in tenants:
+        for name, (url, interval) in tenant.sources().items():
+            sources[url] = min(interval, sources.get(url, interval))
+    return sources
+
+
+def share_sources():
+    # Rebuild the url-keyed tables from every tenant's config. When tenants disagree, a url gets
+    # the shortest cache ttl asked for and the mirrors of the first tenant that lists some.
+    block_params = tenants[0].params.get("block_window", {})
+    ttls, new_mirrors, new_fetchers = {}, {}, {}
+    for tenant in tenants:
+        names = [name for name in tenant.params.get("cache_ttl", {}) if name not in ("default", "markets")]
+        for name in names:
+            url = tenant.source_url(name)
+            ttls[url] = min(tenant.ttl(name), ttls.get(url, tenant.ttl(name)))
+        for name in tenant.data.get("mirrors", {}):
+            urls = tenant.source_urls(name)
+            if len(urls) > 1 and urls[0] not in new_mirrors:
+                new_mirrors[urls[0]] = urls
+        # Exchange apis are kept as raw bytes, so their adapters decode only the pair they need;
+        # a shared api is listed, fetched and cached once.
+        for market in tenant.settings.markets:
+            ttls[market["api"]] = min(tenant.ttl("markets"), ttls.get(market["api"], tenant.ttl("markets")))
+            new_fetchers[market["api"]] = client.fetch_raw
+        url = tenant.source_url("masternodes.link")
+        if url not in mn_lists:
+            mn_lists[url] = MasternodeList(client)
+        new_fetchers[url] = mn_lists[url].fetch
+        url = tenant.source_url("blocks_info")
+        if url not in block_trackers:
+            block_trackers[url] = BlockTracker(
+                client,
+                capacity=block_params.get("capacity", 2048),
+                blocks=block_params.get("blocks", 100),
+                windows=block_params.get("windows"),
+            )
+        new_fetchers[url] = block_trackers[url].fetch
+    cache.ttls = ttls
+    cache.default_ttl = tenants[0].ttl("default")
+    mirrors.clear()
+    mirrors.update(new_mirrors)
+    fetchers.clear()
+    fetchers.update(new_fetchers)
+
+
+def apply_settings(tenant, new_settings):
+    # Config watcher callback, on the loop: swap in the tenant's new settings and drop what was
+    # derived from the old ones
+    old_sources = shared_sources()
+    tenant.apply(new_settings)
+    share_sources()
+    cache.invalidate()
+    markets = [dict(market) for market in new_settings.markets]
+    if markets != [dict(market) for market in tenant.market_store.snapshot()]:
+        tenant.market_store.replace(new_settings.markets)
+    if shared_sources() != old_sources:
+        refresher.stop()
+        refresher.reset()
+        start_refresher()
+
+
+async def fetch_url(url):
+    # From the url or one of its mirrors, skipping those whose circuit is open
+    return await upstreams.fetch(fetchers.get(url, client.fetch), mirrors.get(url, [url]))
+
+
+async def fetch_urls(urls):
+    return await asyncio.gather(*[fetch_url(url) for url in urls])
+
+
+def note_stale(name, age):
+    stale = stale_sources.get()
+    if stale is not None:
+        stale[name] = max(age, stale.get(name, 0))
+
+
+async def cached_fetch(names, ttl=None):
+    # Serve from the refresher's latest snapshot when there is one, so handlers do not wait on
+    # the network; only sources without a snapshot yet go through the cache. Either may hand
+    # back the last good value of a failing source, which reply() then mentions.
+    tenant = current.get()
+    urls = [tenant.source_url(name) for name in names]
+    snapshots = {url: refresher.latest(url) for url in urls}
+    cold = list(dict.fromkeys(url for url in urls if snapshots[url] is None))
+    fetched = {}
+    if cold:
+        values = await cache.get_many(cold, fetch_urls, ttl=ttl)
+        fetched = dict(zip(cold, values))
+    now = time.time()
+    for name, url in zip(names, urls):
+        if snapshots[url] is not None and refresher.failures(url):
+            note_stale(name, now - snapshots[url].fetched_at)
+        elif snapshots[url] is None and fetched[url] is not None:
+            age = cache.age(url)
+            if age is not None and age > (cache.ttl_for(url) if ttl is None else ttl):
+                note_stale(name, age)
+    return [snapshots[url].value if snapshots[url] is not None else fetched[url] for url in urls]
 
 
-def calculate_supply(block_height):
-    if block_height < 8_000:
-        return 80_000
+def start_refresher():
+    for url, interval in shared_sources().items():
+        refresher.add(url, url, interval, fetch_url)
+    refresher.start(client.loop)
 
-    epochs, remainder = divmod(block_height - 1, 2102400)
-    previous_epochs_total_reward = sum(2102400 * (20 / (2 ** epoch)) for epoch in range(epochs))
-    current_epoch_reward = 20 / (2 ** epochs)
-    current_total_reward = (remainder + 1) * current_epoch_reward
-    return previous_epochs_total_reward + current_total_reward - 79_980
 
+def record_sample(snapshot):
+    # Refresher listener: add the fields that came with this snapshot to the history of every
+    # tenant using the source
+    for tenant in tenants:
+        series = tenant.series
+        if snapshot.name == tenant.source_url("rates"):
+            rates = {rate["code"]: rate for rate in snapshot.value}
+            series.record(
+                price=float(rates["XSG"]["price"]) / float(rates["BTC"]["price"]),
+                volume=float(rates["XSG"]["volume24h"]),
+            )
+        elif snapshot.name == tenant.source_url("net_status"):
+            info = snapshot.value["info"]
+            series.record(hashrate=float(info["networksolps"]), difficulty=float(info["difficulty"]))
+        elif snapshot.name == tenant.source_url("masternodes.link"):
+            series.record(masternodes=snapshot.value.enabled)
 
-async def fetch_all(urls, loop):
-    async with aiohttp.ClientSession(loop=loop, connector=aiohttp.TCPConnector(ssl=False)) as session:
-        results = await asyncio.gather(*[fetch(session, url) for url in urls], return_exceptions=True)
-        return results
 
+def alert_values(tenant, snapshot):
+    # alerts.METRICS values that came with this snapshot, if it is one of the tenant's sources
+    if snapshot.name == tenant.source_url("rates"):
+        return {"price": next(float(rate["price"]) for rate in snapshot.value if rate["code"] == "XSG")}
+    if snapshot.name == tenant.source_url("net_status"):
+        info = snapshot.value["info"]
+        return {"hashrate": float(info["networksolps"]), "difficulty": float(info["difficulty"])}
+    if snapshot.name == tenant.source_url("masternodes.link"):
+        return {"mn": snapshot.value.enabled}
+    return {}
 
-def url_fetch(url_list):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(fetch_all(url_list, loop))
 
+def check_alerts(snapshot):
+    # Refresher listener: notify the chats whose alerts the new values crossed. Only the
+    # thresholds between the previous and the new value are looked at.
+    for tenant in tenants:
+        for metric, value in alert_values(tenant, snapshot).items():
+            for alert in tenant.alerts.observe(metric, value):
+                if tenant.notifier is not None:
+                    tenant.notifier.notify(alert.chat_id, alert_message(alert, value))
+
+
+def alert_message(alert, value):
+    title, fmt = alerts.METRICS[alert.metric]
+    word = "above" if alert.op == ">" else "below"
+    return f"\U0001f514 *{title}* is {word} *{fmt(alert.threshold)}*, now *{fmt(value)}*."
+
+
+def digest_message(tenant):
+    # The latest value of every alert metric with its change over the last day
+    lines = [tenant.data["alert"]["digest"]]
+    rates = refresher.latest(tenant.source_url("rates"))
+    for metric, (title, fmt) in alerts.METRICS.items():
+        value = tenant.alerts.values.get(metric)
+        if value is None:
+            continue
+        if metric == "price":
+            # No snapshot when the rates url changed since the price was seen
+            xsg = [rate for rate in rates.value if rate["code"] == "XSG"] if rates is not None else []
+            change = float(xsg[0]["pricechange"]) if xsg else None
+        else:
+            summary = tenant.series.summary(CHART_METRICS[metric][0], 86400)
+            change = summary["change"] if summary is not None else None
+        line = f"• {title} • *{fmt(value)}*"
+        lines.append(line if change is None else f"{line} ({change:+1.2f} % 24h)")
+    return "\n".join(lines)
+
+
+async def send_digests():
+    # Every hour on the hour, queue the digests of the chats that asked for one at this UTC hour
+    target = 0
+    while True:
+        # The hour is taken from the target, not from the clock after sleeping, and the next target
+        # counts from the last one, so waking up a little early cannot send an hour twice
+        now = max(int(time.time()), target)
+        target = now + alerts.seconds_to_next_hour(now)
+        await asyncio.sleep(target - time.time())
+        hour = time.gmtime(target).tm_hour
+        for tenant in tenants:
+            chats = tenant.alerts.due_digests(hour)
+            if not chats or tenant.notifier is None:
+                continue
+            try:
+                message = digest_message(tenant)
+            except Exception as e:
+                logger.warning(f"Building the digest of {tenant.name} failed: {e!r}")
+                continue
+            for chat_id in chats:
+                tenant.notifier.notify(chat_id, message)
+
+
+def record_markets(snapshot):
+    # Refresher listener: add a price/volume row to the market history of every tenant listing
+    # this exchange api, in USD at the latest rates
+    for tenant in tenants:
+        markets = [market for market in tenant.market_store.snapshot() if market["api"] == snapshot.name]
+        rates = refresher.latest(tenant.source_url("rates"))
+        if not markets or rates is None:
+            continue
+        usd_prices = {rate["code"]: float(rate["price"]) for rate in rates.value}
+        for market in markets:
+            try:
+                last, volume = exchanges.adapters[market["exchange"]].parse(snapshot.value, market)
+                tenant.market_store.record(market, usd_prices[market["pair"]] * last, usd_prices["XSG"] * volume)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Recording {market['source']}_{market['pair']} failed: {e!r}")
+
+
+async def save_series(interval):
+    while True:
+        await asyncio.sleep(interval)
+        for tenant in tenants:
+            try:
+                await pipeline.run_sync(tenant.series.write, tenant.series.export())
+            except OSError as e:
+                logger.warning(f"Saving the history of {tenant.name} failed: {e!r}")
+
+
+def command_key(update):
+    # "/Coin@HeimdallBot  info" and "/coin info" are the same command
+    words = update.message.text.lower().split()
+    words[0] = words[0].split("@")[0]
+    return " ".join(words)
+
+
+def admit(tenant, update):
+    # Runs on the loop before a command is queued: users over their budget are ignored, and
+    # identical commands in a chat within the coalescing window are answered once. Only a
+    # command that is queued counts as the first, so nothing is merged into a dropped one.
+    if update.message is None or not update.message.text:
+        return True
+    if not tenant.limiter.allow_user(update.effective_user.id if update.effective_user else None):
+        return False
+    chat_id, key = update.effective_chat.id, command_key(update)
+    if tenant.coalescer.is_duplicate(chat_id, key):
+        tenant.limiter.counts["merged"] += 1
+        return False
+    tenant.coalescer.remember(chat_id, key)
+    return True
+
+
+def format_age(seconds):
+    if seconds < 3600:
+        return f"{max(1, round(seconds / 60))} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:1.1f} h"
+    return f"{seconds / 86400:1.1f} days"
+
+
+def stale_note(stale):
+    # One line per failing api, with the age of the oldest data used from it
+    tenant = current.get()
+    ages = {}
+    for name, age in stale.items():
+        source = tenant.data["stale"]["sources"].get(name, tenant.data["stale"]["default"])
+        ages[source] = max(age, ages.get(source, 0))
+    return "\n".join(
+        tenant.data["stale"]["note"].format(source=source, age=format_age(age)) for source, age in ages.items()
+    )
+
+
+def command(callback, tenant):
+    # Run the command as `tenant`'s, with its own record of the stale sources it used for reply()
+    # to mention
+    @functools.wraps(callback)
+    async def run(update, context):
+        current.set(tenant)
+        stale_sources.set({})
+        await callback(update, context)
+
+    return run
+
+
+def handle(callback, tenant):
+    # The pipeline's on_timeout is awaited on the worker; the reply runs in a task of its own so
+    # setting the tenant there does not leak into the worker's later jobs
+    def missed(update, context):
+        return asyncio.ensure_future(command(deadline_missed, tenant)(update, context))
+
+    return pipeline.handler(command(callback, tenant), admit=functools.partial(admit, tenant), on_timeout=missed)
+
+
+async def reply(update, message, **kwargs):
+    limiter = current.get().limiter
+    stale = stale_sources.get()
+    if stale:
+        message = f"{message}\n\n{stale_note(stale)}"
+        stale.clear()
+    if not await limiter.acquire(update.effective_chat.id):
+        logger.warning(f"Dropped reply to chat {update.effective_chat.id}, it is over its rate limit.")
+        return
+    # The telegram api is synchronous, so sending happens on the pipeline's threads.
+    started = time.monotonic()
+    try:
+        await pipeline.run_sync(update.message.reply_text, message, **kwargs)
+    except Exception:
+        send_seconds.labels(outcome="error").observe(time.monotonic() - started)
+        raise
+    send_seconds.labels(outcome="ok").observe(time.monotonic() - started)
 
-def help(update, context):
-    message = "\n".join(data["help"])
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
 
+async def deadline_missed(update, context):
+    await reply(update, "The upstream apis are slow right now, please try again in a moment.")
 
-def links(update, context):
-    message = "\n".join(data["links"])
-    update.message.reply_text(message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+async def report_stats(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Pipeline stats: {pipeline.stats()}")
+        for tenant in tenants:
+            tenant.limiter.prune()
+            logger.info(f"Rate limit stats of {tenant.name}: {tenant.limiter.stats()}")
+        logger.info(f"Cache stats: {cache.stats()}")
 
-def roadmap(update, context):
-    message = f"{data['roadmap']}"
-    update.message.reply_text(message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+async def help(update, context):
+    tenant = current.get()
+    message = "\n".join(tenant.data["help"])
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN)
 
-def por(update, context):
-    message = f"{data['por']}"
-    update.message.reply_text(message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
+async def links(update, context):
+    tenant = current.get()
+    message = "\n".join(tenant.data["links"])
+    await reply(update, message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
-def about(update, context):
-    message = "\n".join(data["about"])
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
+async def roadmap(update, context):
+    tenant = current.get()
+    message = f"{tenant.data['roadmap']}"
+    await reply(update, message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
-def net_stats(update, context):
-    url_list = [data["blocks_info"], data["net_status"]]
-    htmls = url_fetch(url_list)
+
+async def por(update, context):
+    tenant = current.get()
+    message = f"{tenant.data['por']}"
+    await reply(update, message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+async def about(update, context):
+    tenant = current.get()
+    message = "\n".join(tenant.data["about"])
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+
+async def net_stats(update, context):
+    tenant = current.get()
+    if len(context.args) > 0:
+        await net_history(update, context.args[0].lower())
+        return
+
+    url_list = [tenant.data["blocks_info"], tenant.data["net_status"]]
+    htmls = await cached_fetch(["blocks_info", "net_status"])
     for i in range(len(htmls)):
         if htmls[i] is None:
             message = f"There was an error with {url_list[i]} api."
-            update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+            await reply(update, message, parse_mode=ParseMode.MARKDOWN)
             logger.warning(f"There was an error with {url_list[i]} api.")
             return
 
-    now = htmls[0]["blocks"][0]["time"]
-    if len(htmls[0]["blocks"]) > 1:
-        max_blocks = len(htmls[0]["blocks"]) - 1
-        before = htmls[0]["blocks"][max_blocks]["time"]
-        avg_bt = (now - before) / max_blocks
-    else:
-        avg_bt = 60
-    last_block = htmls[0]["blocks"][0]["height"]
-    version = params["daemon_ver"]
+    avg_bt = htmls[0].avg_bt
+    avg_bt_24h = htmls[0].windows.get("24h", avg_bt)
+    last_block = htmls[0].height
+    version = tenant.params["daemon_ver"]
     diff = htmls[1]["info"]["difficulty"]
     hashrate = htmls[1]["info"]["networksolps"]
 
     message = (
         f"• Version • *{version}*\n• Block Height • *{last_block:,}*\n• Avg Block Time • *{round(avg_bt, 2)}"
-        + f" s*\n• Network Hashrate • *{int(hashrate)/1000} kSol/s*\n• Network Difficulty • *{diff:1.3f}*"
+        + f" s* (24h • *{round(avg_bt_24h, 2)} s*)\n• Median Block Time • *{htmls[0].p50:1.0f} s*"
+        + f" (p90 • *{htmls[0].p90:1.0f} s*)\n• Network Hashrate • *{int(hashrate)/1000} kSol/s*"
+        + f"\n• Network Difficulty • *{diff:1.3f}*"
     )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+
+# Metric name in /chart -> (series field, title, number format)
+CHART_METRICS = {
+    "price": ("price", "XSG/BTC Price", lambda v: f"{v:1.8f} BTC"),
+    "volume": ("volume", "24h Volume", lambda v: f"{v:1,.2f}$"),
+    "hashrate": ("hashrate", "Network Hashrate", lambda v: f"{v/1000:1.2f} kSol/s"),
+    "difficulty": ("difficulty", "Network Difficulty", lambda v: f"{v:1.3f}"),
+    "mn": ("masternodes", "Active Masternodes", lambda v: f"{v:1.0f}"),
+}
+
+
+def history_message(metric, period):
+    tenant = current.get()
+    field, title, fmt = CHART_METRICS[metric]
+    summary = tenant.series.summary(field, parse_period(period))
+    if summary is None:
+        return f"*{title}* • {period}\n{tenant.data['chart']['empty']}"
+    return (
+        f"*{title}* • {period}\n`{summary['spark']}`\n• Now • *{fmt(summary['last'])}* ({summary['change']:+1.2f} %)"
+        + f"\n• Min • *{fmt(summary['min'])}*\n• Max • *{fmt(summary['max'])}*\n• Avg • *{fmt(summary['avg'])}*"
+    )
+
+
+async def net_history(update, period):
+    tenant = current.get()
+    if parse_period(period) is None:
+        message = f"{tenant.data['chart']['default']}"
+    else:
+        message = history_message("hashrate", period) + "\n\n" + history_message("difficulty", period)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN)
+
+
+async def chart(update, context):
+    tenant = current.get()
+    if len(context.args) < 2 or context.args[0].lower() not in CHART_METRICS or parse_period(context.args[1]) is None:
+        message = f"{tenant.data['chart']['default']}"
+    else:
+        message = history_message(context.args[0].lower(), context.args[1].lower())
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN)
 
 
-def halving(update, context):
-    url_list = [data["blocks_info"]]
-    htmls = url_fetch(url_list)
+async def halving(update, context):
+    tenant = current.get()
+    url_list = [tenant.data["blocks_info"]]
+    htmls = await cached_fetch(["blocks_info"])
     if htmls[0] is None:
         message = f"There was an error with {url_list[0]} api."
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        await reply(update, message, parse_mode=ParseMode.MARKDOWN)
         logger.warning(f"There was an error with {url_list[0]} api.")
         return
 
-    now = htmls[0]["blocks"][0]["time"]
-    if len(htmls[0]["blocks"]) > 1:
-        max_blocks = len(htmls[0]["blocks"]) - 1
-        before = htmls[0]["blocks"][max_blocks]["time"]
-        avg_bt = (now - before) / max_blocks
-    else:
-        avg_bt = 60
-    last_block = htmls[0]["blocks"][0]["height"]
-    halving_time = (2102400 - last_block) * avg_bt / 86400
+    # The whole day of blocks gives a steadier estimate over a horizon of months
+    avg_bt = htmls[0].windows.get("24h", htmls[0].avg_bt)
+    last_block = htmls[0].height
+    next_halving = tenant.schedule.next_halving(last_block)
+    halving_time = (next_halving - last_block) * avg_bt / 86400
+    next_reward = tenant.schedule.block_reward(next_halving + 1)
     message = (
         f"The next halving will be in approximately *{halving_time:1.2f}* days (*{halving_time/365:1.3f}"
-        + "* years).\nThe block reward after the halving will be *10* XSG."
+        + f"* years).\nThe block reward after the halving will be *{next_reward:g}* XSG."
     )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN)
 
 
-def calc(update, context):
+async def calc(update, context):
+    tenant = current.get()
     if len(context.args) < 1:
-        message = f"{data['hpow']['default']}"
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+        message = f"{tenant.data['hpow']['default']}"
+        await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
         return
     cmd = context.args[0].lower()
     if cmd == "infinity" or cmd == "infinite" or cmd == "inf":
-        message = f"{data['hpow']['infinity']}"
+        message = f"{tenant.data['hpow']['infinity']}"
     elif not is_number(cmd):
-        message = f"{data['hpow']['default']}"
+        message = f"{tenant.data['hpow']['default']}"
     elif cmd == "0":
-        message = f"{data['hpow']['zero']}"
+        message = f"{tenant.data['hpow']['zero']}"
     elif is_number(cmd) and float(cmd) < 0:
-        message = f"{data['hpow']['neg']}"
+        message = f"{tenant.data['hpow']['neg']}"
     elif is_number(cmd):
-        url_list = [data["blocks_info"], data["rates"], data["net_status"]]
-        htmls = url_fetch(url_list)
+        url_list = [tenant.data["blocks_info"], tenant.data["rates"], tenant.data["net_status"]]
+        htmls = await cached_fetch(["blocks_info", "rates", "net_status"])
         for i in range(len(htmls)):
             if htmls[i] is None:
                 message = f"There was an error with {url_list[i]} api."
-                update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+                await reply(update, message, parse_mode=ParseMode.MARKDOWN)
                 logger.warning(f"There was an error with {url_list[i]} api.")
                 return
 
-        now = htmls[0]["blocks"][0]["time"]
-        if len(htmls[0]["blocks"]) > 1:
-            max_blocks = len(htmls[0]["blocks"]) - 1
-            before = htmls[0]["blocks"][max_blocks]["time"]
-            avg_bt = (now - before) / max_blocks
-        else:
-            avg_bt = 60
+        avg_bt = htmls[0].avg_bt
         for i in range(len(htmls[1])):
             if htmls[1][i]["code"] == "XSG":
                 xsg_usd_price = float(htmls[1][i]["price"])
         hashrate = htmls[2]["info"]["networksolps"]
-        mnr_rwd = float(params["mnr_rwd"])
         cmd = float(cmd)
+        sol_rates = emission.rates(avg_bt, float(tenant.params["mnr_rwd"]), hashrate)
+        hourly, daily = emission.table([cmd], sol_rates, ("hour", "day"))[0]
 
         message = (
             f"Current network hashrate is *{int(hashrate)/1000:1.2f} KSols/s*.\nA hashrate of *{cmd:1.0f}"
-            + f" Sols/s* will get you approximately *{cmd/hashrate*3600*mnr_rwd/avg_bt:1.2f} XSG* _("
-            + f"{cmd/hashrate*3600*mnr_rwd/avg_bt*xsg_usd_price:1.2f}$)_ per *hour* and *"
-            + f"{cmd/hashrate*3600*mnr_rwd*24/avg_bt:1.2f} XSG* _("
-            + f"{cmd/hashrate*3600*mnr_rwd*24/avg_bt*xsg_usd_price:1.2f}$)_ per *day* at current "
-            + "network difficulty."
+            + f" Sols/s* will get you approximately *{hourly:1.2f} XSG* _({hourly*xsg_usd_price:1.2f}$)_ per *hour*"
+            + f" and *{daily:1.2f} XSG* _({daily*xsg_usd_price:1.2f}$)_ per *day* at current network difficulty."
         )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
 
-def mninfo(update, context):
-    url_list = [data["blocks_info"], data["masternodes"]["link"], data["masternodes"]["asgard_managed"]]
-    htmls = url_fetch(url_list)
+async def mninfo(update, context):
+    tenant = current.get()
+    url_list = [
+        tenant.data["blocks_info"],
+        tenant.data["masternodes"]["link"],
+        tenant.data["masternodes"]["asgard_managed"],
+    ]
+    htmls = await cached_fetch(["blocks_info", "masternodes.link", "masternodes.asgard_managed"])
     for i in range(len(htmls) - 1):
         if htmls[i] is None:
             message = f"There was an error with {url_list[i]} api."
-            update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+            await reply(update, message, parse_mode=ParseMode.MARKDOWN)
             logger.warning(f"There was an error with {url_list[i]} api.")
             return
     if htmls[2] is None:
         htmls[2] = 0
-        logger.warning(f"There was an error with {data['masternodes']['asgard_managed']} api.")
+        logger.warning(f"There was an error with {tenant.data['masternodes']['asgard_managed']} api.")
 
-    now = htmls[0]["blocks"][0]["time"]
-    if len(htmls[0]["blocks"]) > 1:
-        max_blocks = len(htmls[0]["blocks"]) - 1
-        before = htmls[0]["blocks"][max_blocks]["time"]
-        avg_bt = (now - before) / max_blocks
-    else:
-        avg_bt = 60
-    mn_count_s = json.dumps(htmls[1])
-    mn_count = mn_count_s.count("ENABLED")
+    avg_bt = htmls[0].avg_bt
+    mn_count = htmls[1].enabled
     asgard_managed = htmls[2]
-    mn_rwd = float(params["mn_rwd"])
-    guide_link = data["masternodes"]["guide_link"]
-    asgard = data["masternodes"]["asgard"]
-    asgard_vid = data["masternodes"]["asgard_vid"]
-    mn_roi = mn_rwd * 3153600 / avg_bt / mn_count / 10
-    time_first_payment = 2.6 * mn_count / 60
+    node_rates = emission.rates(avg_bt, float(tenant.params["mn_rwd"]), mn_count)
+    guide_link = tenant.data["masternodes"]["guide_link"]
+    asgard = tenant.data["masternodes"]["asgard"]
+    asgard_vid = tenant.data["masternodes"]["asgard_vid"]
+    mn_roi = emission.roi(node_rates, tenant.collateral)
+    time_first_payment = emission.first_payment_hours(mn_count)
     message = (
         f"• Active masternodes • <b>{mn_count: 1.0f}</b> (<b>{asgard_managed}</b><i> managed by </i><b>Asgard</b>)"
-        + f"\n• Coins Locked • <b>{mn_count*10000:,} XSG</b>\n• ROI "
+        + f"\n• Coins Locked • <b>{mn_count * tenant.collateral:,} XSG</b>\n• ROI "
         + f"• <b>{mn_roi: 1.3f} % </b>\n• Minimum time before first payment • <b>{time_first_payment: 1.2f} hours</b>"
-        + f"\n• One masternode will give you approximately <b>{3600*24/avg_bt*mn_rwd/mn_count:1.3f} XSG</b> per"
+        + f"\n• One masternode will give you approximately <b>{emission.rate(node_rates, 'day'):1.3f} XSG</b> per"
         + f" <b>day</b>\n{asgard}{asgard_vid}{guide_link}"
     )
-    update.message.reply_text(message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+def node_rewards_message(nodes, node_rates, xsg_usd_price):
+    rewards = emission.table([nodes], node_rates)[0]
+    message = f"*{nodes:1.0f}* Masternode will give you approximately:"
+    for period, xsg in zip(("day", "week", "month", "year"), rewards):
+        message += f"\n*{xsg:1.3f} XSG* _({xsg*xsg_usd_price:1.3f}$)_ per *{period}*"
+    return message
+
+
+# Largest node count a /mnrew range may go up to
+MAX_NODES = 1_000_000
 
 
-def mnrew(update, context):
-    url_list = [data["blocks_info"], data["rates"], data["masternodes"]["link"]]
-    htmls = url_fetch(url_list)
+def node_range_message(first, last, node_rates, xsg_usd_price):
+    # Rewards of every node count from `first` to `last` (or an even sample of them), computed as one table
+    nodes = emission.node_range(first, last)
+    rewards = emission.table(nodes, node_rates, ("day", "month"))
+    usd = rewards * xsg_usd_price
+    rows = "\n".join(
+        f"{n:>5} {day:>10.3f} {day_usd:>9.2f} {month:>11.2f} {month_usd:>10.2f}"
+        for n, (day, month), (day_usd, month_usd) in zip(nodes, rewards, usd)
+    )
+    return (
+        f"Masternodes *{first}* to *{last}* will give you approximately:\n```\n"
+        + f"{'Nodes':>5} {'XSG/day':>10} {'$/day':>9} {'XSG/month':>11} {'$/month':>10}\n{rows}\n```"
+    )
+
+
+async def mnrew(update, context):
+    tenant = current.get()
+    url_list = [tenant.data["blocks_info"], tenant.data["rates"], tenant.data["masternodes"]["link"]]
+    htmls = await cached_fetch(["blocks_info", "rates", "masternodes.link"])
     for i in range(len(htmls)):
         if htmls[i] is None:
             message = f"There was an error with {url_list[i]} api."
-            update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+            await reply(update, message, parse_mode=ParseMode.MARKDOWN)
             logger.warning(f"There was an error with {url_list[i]} api.")
             return
-    now = htmls[0]["blocks"][0]["time"]
-    if len(htmls[0]["blocks"]) > 1:
-        max_blocks = len(htmls[0]["blocks"]) - 1
-        before = htmls[0]["blocks"][max_blocks]["time"]
-        avg_bt = (now - before) / max_blocks
-    else:
-        avg_bt = 60
+    avg_bt = htmls[0].avg_bt
     for i in range(len(htmls[1])):
         if htmls[1][i]["code"] == "XSG":
             xsg_usd_price = float(htmls[1][i]["price"])
-    mn_count_s = json.dumps(htmls[2])
-    mn_count = mn_count_s.count("ENABLED")
-    mn_rwd = float(params["mn_rwd"])
+    mn_count = htmls[2].enabled
+    node_rates = emission.rates(avg_bt, float(tenant.params["mn_rwd"]), mn_count)
     if len(context.args) < 1:
-        message = (
-            f"*1* Masternode will give you approximately:"
-            + f"\n*{3600*24/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{3600*24/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *day*"
-            + f"\n*{3600*24*7/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{3600*24*7/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *week*"
-            + f"\n*{3600*24*30/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{3600*24*30/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *month*"
-            + f"\n*{3600*24*365/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{3600*24*365/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *year*"
-        )
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+        message = node_rewards_message(1, node_rates, xsg_usd_price)
+        await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
         return
     cmd = context.args[0].lower()
-    if not is_number(cmd):
-        message = f"{data['mnrewards']['default']}"
+    node_range = re.fullmatch(r"(\d+)-(\d+)", cmd)
+    if node_range is not None:
+        first, last = int(node_range.group(1)), int(node_range.group(2))
+        if 0 < first < last <= MAX_NODES:
+            message = node_range_message(first, last, node_rates, xsg_usd_price)
+        else:
+            message = f"{tenant.data['mnrewards']['range']}"
+    elif not is_number(cmd):
+        message = f"{tenant.data['mnrewards']['default']}"
     elif cmd == "0":
-        message = f"{data['mnrewards']['zero']}"
+        message = f"{tenant.data['mnrewards']['zero']}"
     elif is_number(cmd) and float(cmd) < 0:
-        message = f"{data['mnrewards']['neg']}"
+        message = f"{tenant.data['mnrewards']['neg']}"
     elif is_number(cmd):
-        cmd = float(cmd)
-        message = (
-            f"*{cmd:1.0f}* Masternode will give you approximately:"
-            + f"\n*{cmd*3600*24/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{cmd*3600*24/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *day*"
-            + f"\n*{cmd*3600*24*7/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{cmd*3600*24*7/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *week*"
-            + f"\n*{cmd*3600*24*30/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{cmd*3600*24*30/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *month*"
-            + f"\n*{cmd*3600*24*365/avg_bt*mn_rwd/mn_count:1.3f} XSG* _("
-            + f"{cmd*3600*24*365/avg_bt*mn_rwd/mn_count*xsg_usd_price:1.3f}$)_ per *year*"
-        )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+        message = node_rewards_message(float(cmd), node_rates, xsg_usd_price)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
 
-def coin_info(update, context):
-    url_list = [data["masternodes"]["link"], data["rates"], data["blocks_info"]]
-    htmls = url_fetch(url_list)
+async def coin_info(update, context):
+    tenant = current.get()
+    url_list = [tenant.data["masternodes"]["link"], tenant.data["rates"], tenant.data["blocks_info"]]
+    htmls = await cached_fetch(["masternodes.link", "rates", "blocks_info"])
     for i in range(len(htmls)):
         if htmls[i] is None:
             message = f"There was an error with {url_list[i]} api."
-            update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+            await reply(update, message, parse_mode=ParseMode.MARKDOWN)
             logger.warning(f"There was an error with {url_list[i]} api.")
             return
-    mn_count_s = json.dumps(htmls[0])
-    mn_count = mn_count_s.count("ENABLED")
+    mn_count = htmls[0].enabled
     for i in range(len(htmls[1])):
         if htmls[1][i]["code"] == "XSG":
             xsg_usd_price = float(htmls[1][i]["price"])
@@ -307,103 +789,96 @@ def coin_info(update, context):
             xsg_24change = float(htmls[1][i]["pricechange"])
         if htmls[1][i]["code"] == "BTC":
             btc_usd_price = float(htmls[1][i]["price"])
-    last_block = htmls[2]["blocks"][0]["height"]
-    xsg_circ_supply = calculate_supply(last_block)
+    last_block = htmls[2].height
+    xsg_circ_supply = tenant.schedule.supply(last_block)
     xsg_mcap = xsg_circ_supply * xsg_usd_price
     message = (
         f"• Current Price • *{xsg_usd_price/btc_usd_price:1.8f} BTC* | *{xsg_usd_price:1.4f}$*\n• 24h Volume •"
         + f" *{xsg_24vol/btc_usd_price:1.3f} BTC* | *{xsg_24vol:1,.2f}$*\n• Market Cap • *{xsg_mcap:1,.0f}$*"
         + f"\n• Circulating Supply • *{xsg_circ_supply:1,.0f} XSG*\n• Locked Coins • *"
-        + f"{mn_count*10000:,} XSG*\n• 24h Change • *{xsg_24change:1.2f} %*"
+        + f"{mn_count * tenant.collateral:,} XSG*\n• 24h Change • *{xsg_24change:1.2f} %*"
     )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
 
-def xsg_usd(update, context):
-    url_list = [data["rates"]]
-    htmls = url_fetch(url_list)
+async def xsg_usd(update, context):
+    tenant = current.get()
+    url_list = [tenant.data["rates"]]
+    htmls = await cached_fetch(["rates"])
     if htmls[0] is None:
         message = f"There was an error with {url_list[0]} api."
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        await reply(update, message, parse_mode=ParseMode.MARKDOWN)
         logger.warning(f"There was an error with {url_list[0]} api.")
         return
     for i in range(len(htmls[0])):
         if htmls[0][i]["code"] == "XSG":
             xsg_usd_price = float(htmls[0][i]["price"])
     if len(context.args) < 1:
-        message = f"{data['xsgusd']['default']}{round(xsg_usd_price, 3)}$._"
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        message = f"{tenant.data['xsgusd']['default']}{round(xsg_usd_price, 3)}$._"
+        await reply(update, message, parse_mode=ParseMode.MARKDOWN)
         return
     cmd = context.args[0].lower()
     if not is_number(cmd):
-        message = f"{data['xsgusd']['default']}{round(xsg_usd_price, 3)}$*."
+        message = f"{tenant.data['xsgusd']['default']}{round(xsg_usd_price, 3)}$*."
     elif cmd == "0":
-        message = f"{data['xsgusd']['zero']}"
+        message = f"{tenant.data['xsgusd']['zero']}"
     elif is_number(cmd) and float(cmd) < 0:
-        message = f"{data['xsgusd']['neg']}"
+        message = f"{tenant.data['xsgusd']['neg']}"
     elif is_number(cmd):
         message = (
             f"*{round(float(cmd),2):,} XSG* = *{round(float(xsg_usd_price)*float(cmd),2):,}$*\n"
-            + f"{data['xsgusd']['default']}{round(xsg_usd_price, 3)}$._"
+            + f"{tenant.data['xsgusd']['default']}{round(xsg_usd_price, 3)}$._"
         )
-    update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
 
-def market_info(update, context):
+async def market_info(update, context):
+    # Work on a private copy; the store swaps in the updated list when we are done
+    tenant = current.get()
+    markets = [dict(market) for market in tenant.market_store.snapshot()]
     message_list = []
     message_list.append("<b>SnowGem</b> is listed on the following exchanges:")
     for i in range(len(markets)):
         message_list.append(f"{i+1}. <a href=\"{markets[i]['link']}\">{markets[i]['source']}_{markets[i]['pair']}</a>")
-    message_list.append("<i>Use </i>/market info<i> for stats of the markets</i>")
-    if len(context.args) < 1 or context.args[0].lower() != "info":
+    message_list.append(
+        "<i>Use </i>/market info<i> for stats of the markets, </i>/market history 7d<i> for their history</i>"
+    )
+    if len(context.args) > 0 and context.args[0].lower() == "history":
+        period = context.args[1].lower() if len(context.args) > 1 else "7d"
+        message = await market_history(tenant, markets, period) if parse_period(period) else "\n".join(message_list)
+    elif len(context.args) < 1 or context.args[0].lower() != "info":
         message = "\n".join(message_list)
     else:
         vol_total = 0
-        url_list = [data["rates"]]
+        url_list = [tenant.data["rates"]]
         for i in range(len(markets)):
             url_list.append(markets[i]["api"])
-        htmls = url_fetch(url_list)
+        rates, apis = await asyncio.gather(cached_fetch(["rates"]), cached_fetch(url_list[1:]))
+        htmls = rates + apis
         for i in range(len(htmls)):
             if htmls[i] is None:
                 message = f"There was an error with {url_list[i]} api."
-                update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+                await reply(update, message, parse_mode=ParseMode.MARKDOWN)
                 logger.warning(f"There was an error with {url_list[i]} api.")
                 return
-        for i in range(len(htmls[0])):
-            if htmls[0][i]["code"] == "XSG":
-                xsg_usd_price = float(htmls[0][i]["price"])
-            if htmls[0][i]["code"] == "BTC":
-                btc_usd_price = float(htmls[0][i]["price"])
-            if htmls[0][i]["code"] == "ETH":
-                eth_usd_price = float(htmls[0][i]["price"])
+        usd_prices = {rate["code"]: float(rate["price"]) for rate in htmls[0]}
         for a in range(len(markets)):
-            if markets[a]["link"] == "https://graviex.net/markets/xsgbtc":
-                markets[a]["volume_24h"] = xsg_usd_price * float(htmls[a + 1]["ticker"]["vol"])
-                usd_price = btc_usd_price * float(htmls[a + 1]["ticker"]["last"])
-                markets[a]["price"] = usd_price
-                vol_total = vol_total + float(markets[a]["volume_24h"])
-            elif markets[a]["link"] == "https://app.stex.com/en/trade/pair/BTC/XSG":
-                markets[a]["volume_24h"] = xsg_usd_price * float(htmls[a + 1]["data"]["volumeQuote"])
-                usd_price = btc_usd_price * float(htmls[a + 1]["data"]["last"])
-                markets[a]["price"] = usd_price
-                vol_total = vol_total + float(markets[a]["volume_24h"])
-            elif markets[a]["link"] == "https://mercatox.com/exchange/XSG/BTC":
-                markets[a]["volume_24h"] = xsg_usd_price * float(htmls[a + 1]["pairs"]["XSG_BTC"]["baseVolume"])
-                usd_price = btc_usd_price * float(htmls[a + 1]["pairs"]["XSG_BTC"]["last"])
-                markets[a]["price"] = usd_price
-                vol_total = vol_total + float(markets[a]["volume_24h"])
-            elif markets[a]["link"] == "https://mercatox.com/exchange/XSG/ETH":
-                markets[a]["volume_24h"] = xsg_usd_price * float(htmls[a + 1]["pairs"]["XSG_ETH"]["baseVolume"])
-                usd_price = eth_usd_price * float(htmls[a + 1]["pairs"]["XSG_ETH"]["last"])
-                markets[a]["price"] = usd_price
-                vol_total = vol_total + float(markets[a]["volume_24h"])
+            try:
+                last, volume = exchanges.adapters[markets[a]["exchange"]].parse(htmls[a + 1], markets[a])
+            except (KeyError, ValueError) as e:
+                message = f"There was an error with {url_list[a + 1]} api."
+                await reply(update, message, parse_mode=ParseMode.MARKDOWN)
+                logger.warning(f"There was an error with {url_list[a + 1]} api: {e!r}")
+                return
+            markets[a]["volume_24h"] = usd_prices["XSG"] * volume
+            markets[a]["price"] = usd_prices[markets[a]["pair"]] * last
+            vol_total = vol_total + float(markets[a]["volume_24h"])
         max_source = 0
         for a in range(len(markets)):
             markets[a]["vol_percent"] = float(markets[a]["volume_24h"]) / vol_total * 100
             max_source = max(6, max_source, len(markets[a]["source"] + "_" + markets[a]["pair"]))
         markets.sort(key=lambda x: x["volume_24h"], reverse=True)
-        with open("market.json", "w") as file:
-            json.dump(markets, file, indent=2)
+        tenant.market_store.update(markets)
         message = """
 <pre>
 +------{a}+----------+
@@ -428,7 +903,96 @@ def market_info(update, context):
             ),
             vol="{:>9.2f}$".format(vol_total)
         )
-    update.message.reply_text(message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    await reply(update, message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+async def market_history(tenant, markets, period):
+    # Average volume and price change of every market over the period, from the market history
+    since = time.time() - parse_period(period)
+    lines = [f"<b>Markets</b> • {period}"]
+    for market in markets:
+        rows = await pipeline.run_sync(tenant.market_store.history, market["source"], market["pair"], since)
+        name = f"{market['source']}_{market['pair']}"
+        if not rows:
+            lines.append(f"• {name} • <i>no history yet</i>")
+            continue
+        volume = sum(row[2] for row in rows) / len(rows)
+        change = (rows[-1][1] / rows[0][1] - 1) * 100 if rows[0][1] else 0
+        lines.append(f"• {name} • avg vol <b>{volume:1,.2f}$</b> • price <b>{change:+1.2f} %</b>")
+    return "\n".join(lines)
+
+
+async def profile(update, context):
+    # Admins only: sample every thread's stack for a while and write a flamegraph-ready profile
+    tenant = current.get()
+    if update.effective_user is None or update.effective_user.id not in tenant.admins:
+        return
+    profile_params = tenant.params.get("profile", {})
+    max_duration = profile_params.get("max_duration", 300)
+    seconds = parse_duration(context.args[0]) if context.args else profile_params.get("duration", 30)
+    if seconds is None or seconds > max_duration:
+        await reply(update, f"Usage: /profile [duration, e.g. 30s, up to {max_duration}s]")
+        return
+    loop = asyncio.get_event_loop()
+    # done() runs on the profiler's thread; its reply must still run as this tenant's command
+    command_context = contextvars.copy_context()
+
+    def done(path, samples):
+        message = f"Profile written to {path} ({samples} samples)." if path else "Profiling failed, see the log."
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(reply(update, message)), context=command_context)
+
+    if profiler.start(seconds, done):
+        message = f"Profiling for {seconds}s."
+    else:
+        message = "A profile is already running."
+    await reply(update, message)
+
+
+async def alert(update, context):
+    tenant = current.get()
+    book = tenant.alerts
+    chat_id = update.effective_chat.id
+    args = [arg.lower() for arg in context.args]
+    alert_params = tenant.params.get("alerts", {})
+    if not args:
+        message = f"{tenant.data['alert']['default']}"
+    elif args[0] == "list":
+        lines = [
+            f"`{a.id}` • {alerts.METRICS[a.metric][0]} {a.op} *{alerts.METRICS[a.metric][1](a.threshold)}*"
+            for a in book.of_chat(chat_id)
+        ]
+        if chat_id in book.digests:
+            lines.append(f"Daily digest at *{book.digests[chat_id]:02d}:00 UTC*")
+        message = "\n".join(lines) if lines else f"{tenant.data['alert']['default']}"
+    elif args[0] == "del" and len(args) == 2 and args[1].isdigit():
+        removed = book.remove(int(args[1]), chat_id)
+        message = f"Alert `{removed.id}` removed." if removed else f"{tenant.data['alert']['unknown']}"
+    elif args[0] == "digest":
+        if len(args) > 1 and args[1] == "off":
+            book.set_digest(chat_id, None)
+            message = "Daily digest off."
+        elif len(args) > 1 and not (args[1].isdigit() and int(args[1]) < 24):
+            message = f"{tenant.data['alert']['default']}"
+        else:
+            hour = int(args[1]) if len(args) > 1 else alert_params.get("digest_hour", 9)
+            book.set_digest(chat_id, hour)
+            message = f"Daily digest at *{hour:02d}:00 UTC*."
+    else:
+        parsed = alerts.parse_alert(args)
+        if parsed is None:
+            message = f"{tenant.data['alert']['default']}"
+        elif len(book.of_chat(chat_id)) >= alert_params.get("max_per_chat", 10):
+            message = f"{tenant.data['alert']['limit']}"
+        else:
+            metric, op, threshold = parsed
+            title, fmt = alerts.METRICS[metric]
+            value = book.values.get(metric)
+            if value is not None and alerts.holds(op, value, threshold):
+                message = f"{title} is already *{fmt(value)}*."
+            else:
+                new = book.add(chat_id, metric, op, threshold)
+                message = f"Alert `{new.id}` set: you will be notified when {title} {op} *{fmt(threshold)}*."
+    await reply(update, message, parse_mode=ParseMode.MARKDOWN)
 
 
 def error(update, context):
@@ -436,34 +1000,129 @@ def error(update, context):
     logger.warning(f"Update {update} caused error {context.error}")
 
 
+# Command name -> handler; all of them take arguments
+COMMANDS = {
+    "help": help,
+    "links": links,
+    "roadmap": roadmap,
+    "por": por,
+    "about": about,
+    "net": net_stats,
+    "halving": halving,
+    "calc": calc,
+    "mn": mninfo,
+    "mnrew": mnrew,
+    "coin": coin_info,
+    "xsgusd": xsg_usd,
+    "market": market_info,
+    "chart": chart,
+    "profile": profile,
+    "alert": alert,
+}
+
+
 def main():
-    # Create the Updater and pass it your bot's token.
+    setup(load_tenants())
+    params = tenants[0].params
+
+    # Create an Updater per tenant with its bot's token.
     # Make sure to set use_context=True to use the new context callbacks
     # Post version 12 this will no longer be necessary
-    updater = Updater(token=TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
-
-    dispatcher.add_handler(CommandHandler("help", help))
-    dispatcher.add_handler(CommandHandler("links", links))
-    dispatcher.add_handler(CommandHandler("roadmap", roadmap))
-    dispatcher.add_handler(CommandHandler("por", por))
-    dispatcher.add_handler(CommandHandler("about", about))
-    dispatcher.add_handler(CommandHandler("net", net_stats))
-    dispatcher.add_handler(CommandHandler("halving", halving))
-    dispatcher.add_handler(CommandHandler("calc", calc, pass_args=True))
-    dispatcher.add_handler(CommandHandler("mn", mninfo))
-    dispatcher.add_handler(CommandHandler("mnrew", mnrew, pass_args=True))
-    dispatcher.add_handler(CommandHandler("coin", coin_info))
-    dispatcher.add_handler(CommandHandler("xsgusd", xsg_usd, pass_args=True))
-    dispatcher.add_handler(CommandHandler("market", market_info, pass_args=True))
-    dispatcher.add_error_handler(error)
-
-    # Start the bot
-    updater.start_polling()
-
-    # Run the bot until the user press Ctrl-C or the process receives SIGINT,
-    # SIGTERM or SIGABRT
-    updater.idle()
+    updaters = []
+    for tenant in tenants:
+        updater = Updater(token=tenant.token, use_context=True)
+        dispatcher = updater.dispatcher
+        # Handlers are coroutines; the dispatcher threads only hand updates over to the pipeline
+        for name, callback in COMMANDS.items():
+            dispatcher.add_handler(CommandHandler(name, handle(callback, tenant), pass_args=True))
+        dispatcher.add_error_handler(error)
+        updaters.append(updater)
+    pipeline.on_error = error
+
+    # Open the shared http client, which also owns the event loop the handlers run on, and keep
+    # the upstream snapshots warm in the background
+    client.start()
+    pipeline.start(client.loop)
+    for tenant, updater in zip(tenants, updaters):
+        tenant.series.load()
+        # Alerts and digests go out through a queue of their own, within the bot's rate limits
+        tenant.alerts.load()
+        tenant.notifier = alerts.Notifier(
+            tenant.limiter,
+            functools.partial(updater.bot.send_message, parse_mode=ParseMode.MARKDOWN),
+            pipeline.run_sync,
+            window=tenant.params.get("alerts", {}).get("batch_window", 1),
+        )
+        tenant.notifier.start(client.loop)
+    start_refresher()
+    asyncio.run_coroutine_threadsafe(send_digests(), client.loop)
+    asyncio.run_coroutine_threadsafe(save_series(params.get("timeseries", {}).get("save_interval", 300)), client.loop)
+    if params.get("pipeline", {}).get("stats_interval"):
+        asyncio.run_coroutine_threadsafe(report_stats(params["pipeline"]["stats_interval"]), client.loop)
+
+    # Pick up edits of each tenant's links.json, params.json and market.json without a restart
+    for tenant in tenants:
+        watcher = ConfigWatcher(
+            tenant.directory,
+            functools.partial(apply_settings, tenant),
+            interval=tenant.params.get("config_poll_interval", 5),
+        )
+        tenant.market_store.on_write = watcher.ignore
+        asyncio.run_coroutine_threadsafe(watcher.run(), client.loop)
+
+    metrics_params = params.get("metrics", {})
+    metrics_server = None
+    if metrics_params.get("enabled"):
+        metrics_server = MetricsServer(
+            metrics, listen=metrics_params.get("listen", "127.0.0.1"), port=metrics_params.get("port", 9108)
+        )
+        client.run(metrics_server.start())
+    # `kill -USR1 <pid>` takes a profile like /profile does
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start(params.get("profile", {}).get("duration", 30)))
+
+    # Run until SIGINT, SIGTERM or SIGABRT, then stop taking updates and finish the queued ones
+    stop = threading.Event()
+    webhook = params.get("webhook", {})
+    if webhook.get("enabled"):
+        # Take every tenant's updates on one embedded aiohttp server, each bot on its own path,
+        # instead of long polling
+        server = WebhookServer(
+            listen=webhook.get("listen", "0.0.0.0"),
+            port=webhook.get("port", 8443),
+            max_connections=webhook.get("max_connections", 40),
+        )
+        for tenant, updater in zip(tenants, updaters):
+            server.add(tenant.webhook_path, updater.bot, updater.dispatcher)
+        client.run(server.start())
+        for tenant, updater in zip(tenants, updaters):
+            updater.bot.set_webhook(
+                url=f"{webhook['url'].rstrip('/')}/{tenant.webhook_path}",
+                max_connections=webhook.get("max_connections", 40),
+            )
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            signal.signal(sig, lambda signum, frame: stop.set())
+        stop.wait()
+        client.run(server.stop(pipeline))
+    else:
+        # Start the bots
+        for updater in updaters:
+            updater.start_polling()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            signal.signal(sig, lambda signum, frame: stop.set())
+        stop.wait()
+        for updater in updaters:
+            updater.stop()
+    pipeline.stop()
+    refresher.stop()
+    for tenant in tenants:
+        tenant.notifier.stop()
+    if metrics_server is not None:
+        client.run(metrics_server.stop())
+    client.close()
+    for tenant in tenants:
+        tenant.market_store.close()
+        tenant.alerts.close()
+        tenant.series.write(tenant.series.export())
 
 
 if __name__ == "__main__":
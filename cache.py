@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+
+class Cache:
+    # TTL cache for upstream payloads, keyed by their urls, so tenants sharing an api share its
+    # entry. Concurrent misses for the same key are collapsed into a single upstream request.
+    # When a refetch fails, the last good value is served instead, however old. Lookups run on
+    # the bot's event loop.
+
+    def __init__(self, ttls=None, default_ttl=30):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = self.ttls.pop("default", default_ttl)
+        self._entries = {}
+        self._in_flight = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def _fresh(self, key, now, ttl):
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < ttl:
+            return entry
+        return None
+
+    def _count(self, key, field):
+        stats = self._stats.setdefault(key, {"hits": 0, "misses": 0, "collapsed": 0, "stale": 0})
+        stats[field] += 1
+
+    def _store(self, owned, task):
+        try:
+            values = task.result()
+        except BaseException:
+            values = [None] * len(owned)
+        now = time.time()
+        with self._lock:
+            for key, value in zip(owned, values):
+                if value is not None:
+                    self._entries[key] = (value, now)
+                elif key in self._entries:
+                    value = self._entries[key][0]
+                    self._count(key, "stale")
+                self._in_flight.pop(key).set_result(value)
+
+    async def get(self, key, loader, ttl=None):
+        async def load(keys):
+            return [await loader()]
+
+        return (await self.get_many([key], load, ttl=ttl))[0]
+
+    async def get_many(self, keys, loader, ttl=None):
+        # `loader` is a coroutine function receiving the list of keys that must be fetched and
+        # returning their values in the same order. Failed fetches (None) are not cached; the
+        # previous value is returned if there is one, else None. The load keeps running if the
+        # caller is cancelled, so the result still lands in the cache for whoever asks next.
+        loop = asyncio.get_event_loop()
+        results = {}
+        owned = []
+        waiting = {}
+        now = time.time()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._fresh(key, now, self.ttl_for(key) if ttl is None else ttl)
+                if entry is not None:
+                    results[key] = entry[0]
+                    self._count(key, "hits")
+                elif key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                    self._count(key, "collapsed")
+                else:
+                    self._in_flight[key] = loop.create_future()
+                    owned.append(key)
+                    self._count(key, "misses")
+
+        if owned:
+            flights = [self._in_flight[key] for key in owned]
+            task = asyncio.ensure_future(loader(owned))
+            task.add_done_callback(lambda task: self._store(owned, task))
+            waiting.update(zip(owned, flights))
+
+        for key, flight in waiting.items():
+            results[key] = await asyncio.shield(flight)
+
+        return [results[key] for key in keys]
+
+    def age(self, key):
+        # Seconds since the value of `key` was fetched, None if there is none
+        entry = self._entries.get(key)
+        return None if entry is None else time.time() - entry[1]
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                key: dict(
+                    stats,
+                    age=round(now - self._entries[key][1], 1) if key in self._entries else None,
+                    ttl=self.ttl_for(key),
+                )
+                for key, stats in self._stats.items()
+            }
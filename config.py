@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+import exchanges
+from scheduler import freeze
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_LINKS = (
+    "help",
+    "links",
+    "roadmap",
+    "por",
+    "about",
+    "blocks_info",
+    "net_status",
+    "rates",
+    "masternodes",
+    "hpow",
+    "mnrewards",
+    "xsgusd",
+    "chart",
+    "stale",
+    "alert",
+)
+REQUIRED_MASTERNODE_LINKS = ("link", "asgard_managed", "asgard", "asgard_vid", "guide_link")
+NUMERIC_PARAMS = ("mnr_rwd", "mn_rwd")
+REQUIRED_MARKET_FIELDS = ("source", "pair", "link", "api", "exchange")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Settings:
+    # One consistent, read-only view of links.json, params.json and market.json
+    links: Mapping
+    params: Mapping
+    markets: tuple
+
+
+def read_json(path):
+    try:
+        with open(path) as data_file:
+            return json.load(data_file)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {path}: {e}")
+
+
+def validate(links, params, markets):
+    missing = [key for key in REQUIRED_LINKS if key not in links]
+    missing += [f"masternodes.{key}" for key in REQUIRED_MASTERNODE_LINKS if key not in links.get("masternodes", {})]
+    if missing:
+        raise ConfigError(f"links.json is missing {', '.join(missing)}")
+    for name, urls in links.get("mirrors", {}).items():
+        if not isinstance(urls, list):
+            raise ConfigError(f"links.json mirrors.{name} must be a list of urls")
+    if "daemon_ver" not in params:
+        raise ConfigError("params.json is missing daemon_ver")
+    for key in NUMERIC_PARAMS:
+        try:
+            float(params[key])
+        except (KeyError, TypeError, ValueError):
+            raise ConfigError(f"params.json {key} must be a number")
+    if not isinstance(markets, list):
+        raise ConfigError("market.json must be a list of markets")
+    for i, market in enumerate(markets):
+        adapter = exchanges.adapters.get(market.get("exchange"))
+        if adapter is None:
+            raise ConfigError(f"market.json entry {i} has no known exchange")
+        missing = [key for key in REQUIRED_MARKET_FIELDS + adapter.required if key not in market]
+        if missing:
+            raise ConfigError(f"market.json entry {i} is missing {', '.join(missing)}")
+
+
+def load_settings(directory="."):
+    links = read_json(os.path.join(directory, "links.json"))
+    params = read_json(os.path.join(directory, "params.json"))
+    markets = read_json(os.path.join(directory, "market.json"))
+    validate(links, params, markets)
+    return Settings(freeze(links), freeze(params), freeze(markets))
+
+
+class ConfigWatcher:
+    # Polls the config files' modification times and hands a freshly loaded Settings to `on_change`
+    # when one of them changes. A file that fails to load or validate keeps the old settings.
+
+    def __init__(self, directory, on_change, interval=5, files=("links.json", "params.json", "market.json")):
+        self.directory = directory
+        self.on_change = on_change
+        self.interval = interval
+        self.paths = [os.path.join(directory, name) for name in files]
+        self._mtimes = {path: self._mtime(path) for path in self.paths}
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def ignore(self, path):
+        # Called after the bot writes one of the files itself, so that write is not taken as a change
+        path = os.path.join(self.directory, os.path.basename(path))
+        if path in self._mtimes:
+            self._mtimes[path] = self._mtime(path)
+
+    def check(self):
+        mtimes = {path: self._mtime(path) for path in self.paths}
+        if mtimes == self._mtimes:
+            return
+        self._mtimes = mtimes
+        try:
+            settings = load_settings(self.directory)
+        except ConfigError as e:
+            logger.warning(f"Keeping the current settings: {e}")
+            return
+        logger.info("Config files changed, reloading.")
+        self.on_change(settings)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
@@ -0,0 +1,76 @@
+import functools
+
+import numpy as np
+
+# Period name -> seconds, in the order rates are listed
+PERIODS = {"hour": 3600, "day": 86400, "week": 604800, "month": 2592000, "year": 31536000}
+SECONDS = np.array(list(PERIODS.values()), dtype="f8")
+# Most rows a node range table shows; longer ranges are sampled evenly
+MAX_ROWS = 50
+
+
+class Emission:
+    # The coin's block reward schedule: `reward` per block, halved every `interval` blocks. Until
+    # `start_height` the supply is the flat `start_supply`; after it, the sum of every block reward
+    # so far less `offset`.
+
+    def __init__(self, reward=20, interval=2102400, start_height=8000, start_supply=80000, offset=79980):
+        self.reward = reward
+        self.interval = interval
+        self.start_height = start_height
+        self.start_supply = start_supply
+        self.offset = offset
+
+    def epoch(self, height):
+        return max(0, height - 1) // self.interval
+
+    def block_reward(self, height):
+        return self.reward / 2 ** self.epoch(height)
+
+    def next_halving(self, height):
+        return (self.epoch(height) + 1) * self.interval
+
+    def supply(self, height):
+        if height < self.start_height:
+            return self.start_supply
+        epochs, remainder = divmod(height - 1, self.interval)
+        # Whole epochs are a geometric series: interval * reward * (1 + 1/2 + ... + 1/2^(epochs-1))
+        previous = self.interval * self.reward * 2 * (1 - 0.5 ** epochs)
+        return previous + (remainder + 1) * self.reward / 2 ** epochs - self.offset
+
+
+@functools.lru_cache(maxsize=64)
+def rates(avg_bt, reward, shares):
+    # XSG earned per period (in PERIODS order) by one of `shares` equal shares of `reward` per
+    # block: one masternode out of the enabled ones, or one Sol/s out of the network hashrate.
+    # The inputs come from the current snapshots, so commands on the same snapshots share it.
+    result = SECONDS / avg_bt * reward / shares
+    result.flags.writeable = False
+    return result
+
+
+def rate(values, period):
+    return values[list(PERIODS).index(period)]
+
+
+def table(amounts, values, periods=("day", "week", "month", "year")):
+    # XSG for every amount (of nodes or Sol/s) over every period, one row per amount, in one pass
+    columns = [list(PERIODS).index(period) for period in periods]
+    return np.outer(np.asarray(amounts, dtype="f8"), values[columns])
+
+
+def roi(node_rates, collateral):
+    # Yearly masternode return in % of the collateral
+    return rate(node_rates, "year") / collateral * 100
+
+
+def first_payment_hours(mn_count):
+    # A new node waits about 2.6 minutes per enabled node before it is first paid
+    return 2.6 * mn_count / 60
+
+
+def node_range(first, last, rows=MAX_ROWS):
+    # The node counts a /mnrew first-last table shows: all of them, or `rows` evenly spread ones
+    if last - first < rows:
+        return np.arange(first, last + 1)
+    return np.unique(np.linspace(first, last, rows).round().astype(int))
@@ -0,0 +1,56 @@
+import json
+
+# Exchange name (the "exchange" field in market.json) -> adapter instance
+adapters = {}
+
+
+def register(name):
+    def decorator(cls):
+        adapters[name] = cls()
+        return cls
+
+    return decorator
+
+
+class Adapter:
+    # Turns the raw body of an exchange's ticker api into (last price in the quote coin, 24h volume in XSG).
+
+    # market.json fields the adapter needs besides the common ones
+    required = ()
+
+    def parse(self, body, market):
+        return self.ticker(json.loads(body), market)
+
+    def ticker(self, payload, market):
+        raise NotImplementedError
+
+
+@register("stex")
+class Stex(Adapter):
+    def ticker(self, payload, market):
+        return float(payload["data"]["last"]), float(payload["data"]["volumeQuote"])
+
+
+@register("graviex")
+class Graviex(Adapter):
+    def ticker(self, payload, market):
+        return float(payload["ticker"]["last"]), float(payload["ticker"]["vol"])
+
+
+@register("mercatox")
+class Mercatox(Adapter):
+    # json24 lists every pair on the exchange; only the (flat) object of our pair is decoded.
+
+    required = ("symbol",)
+
+    def parse(self, body, market):
+        key = f'"{market["symbol"]}"'.encode()
+        start = body.find(key)
+        if start < 0:
+            raise KeyError(market["symbol"])
+        start = body.index(b"{", start + len(key))
+        end = body.index(b"}", start) + 1
+        return self.ticker(json.loads(body[start:end]), market)
+
+    def ticker(self, payload, market):
+        return float(payload["last"]), float(payload["baseVolume"])
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    # Long-lived aiohttp session running on its own event loop thread. Connections are pooled and
+    # kept alive between commands, and the dispatcher's worker threads submit requests with run().
+
+    def __init__(self, limit=100, limit_per_host=8, dns_ttl=300, timeout=10, timeouts=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+        # Per-url overrides of the default request timeout, in seconds
+        self.timeouts = dict(timeouts or {})
+        # Called with (url, status, seconds, size, decode seconds) after every upstream request;
+        # status is the http status or the name of the exception
+        self.on_fetch = None
+        self.loop = None
+        self.session = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name="http-client", daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl, ssl=False
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    def request_timeout(self, url, timeout=None):
+        return aiohttp.ClientTimeout(total=timeout or self.timeouts.get(url, self.timeout))
+
+    def observe(self, url, status, seconds, size=0, decode=None):
+        if self.on_fetch is not None:
+            self.on_fetch(url, status, seconds, size, decode)
+
+    async def fetch(self, url, timeout=None):
+        started = time.monotonic()
+        try:
+            async with self.session.get(url, timeout=self.request_timeout(url, timeout)) as response:
+                # An error status is a failure even with a json body, so the last good value is kept
+                response.raise_for_status()
+                body = await response.read()
+        except aiohttp.ClientResponseError as e:
+            self.observe(url, e.status, time.monotonic() - started)
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            return None
+        except Exception as e:
+            self.observe(url, type(e).__name__, time.monotonic() - started)
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            return None
+        received = time.monotonic()
+        try:
+            value = json.loads(body) if body.strip() else None
+        except ValueError as e:
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            value = None
+        self.observe(url, response.status, received - started, len(body), time.monotonic() - received)
+        return value
+
+    async def fetch_raw(self, url, timeout=None):
+        # Body as bytes, for payloads the caller only wants to partially decode
+        started = time.monotonic()
+        try:
+            async with self.session.get(url, timeout=self.request_timeout(url, timeout)) as response:
+                response.raise_for_status()
+                body = await response.read()
+        except aiohttp.ClientResponseError as e:
+            self.observe(url, e.status, time.monotonic() - started)
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            return None
+        except Exception as e:
+            self.observe(url, type(e).__name__, time.monotonic() - started)
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            return None
+        self.observe(url, response.status, time.monotonic() - started, len(body))
+        return body
+
+    def run(self, coro):
+        # Run a coroutine on the client loop from any thread and wait for its result.
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        with self._lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop = None
+            self.session = None
@@ -0,0 +1,157 @@
+import codecs
+import hashlib
+import logging
+import re
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+MasternodeSummary = namedtuple("MasternodeSummary", ["counts", "total", "enabled", "digest"])
+
+# A json string (possibly cut off by the end of the buffer) or one of the structural characters
+TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)("?)|([:,\[\]{}])', re.S)
+
+
+class StatusCounter:
+    # Incremental scanner over the masternode list json. It only tracks the nesting depth and the
+    # last key, and counts the values of `field` on the objects of the top-level array (not nested
+    # objects, nor a wrapper around the list), so memory stays flat no matter how long the list is.
+
+    def __init__(self, field="status"):
+        self.field = field.lower()
+        self.counts = {}
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._carry = ""
+        self._key = None
+        self._candidate = None
+        self._expect_value = False
+        self._depth = 0
+        # Whether the document is an array, the only shape with masternodes to count
+        self._in_list = False
+
+    def feed(self, chunk):
+        buffer = self._carry + self._decoder.decode(chunk)
+        self._carry = ""
+        for match in TOKEN.finditer(buffer):
+            string, closed, char = match.groups()
+            if string is not None:
+                if not closed:
+                    self._carry = buffer[match.start():]
+                    return
+                if self._expect_value:
+                    if self._key == self.field and self._depth == 2 and self._in_list:
+                        self.counts[string] = self.counts.get(string, 0) + 1
+                    self._expect_value = False
+                else:
+                    self._candidate = string
+            elif char == ":":
+                self._key = (self._candidate or "").lower()
+                self._expect_value = True
+            else:
+                if char in "[{":
+                    if self._depth == 0:
+                        self._in_list = char == "["
+                    self._depth += 1
+                elif char in "]}":
+                    self._depth -= 1
+                self._expect_value = False
+
+    def copy(self):
+        other = StatusCounter(self.field)
+        other.counts = dict(self.counts)
+        other._decoder.setstate(self._decoder.getstate())
+        other._carry, other._key, other._candidate = self._carry, self._key, self._candidate
+        other._expect_value, other._depth, other._in_list = self._expect_value, self._depth, self._in_list
+        return other
+
+    def summary(self, digest=None):
+        total = sum(self.counts.values())
+        enabled = self.counts.get("ENABLED", 0)
+        return MasternodeSummary(MappingProxyType(dict(self.counts)), total, enabled, digest)
+
+
+class MasternodeList:
+    # Streams the masternode list from upstream and keeps its summary. Unchanged lists are detected by
+    # ETag/Last-Modified (answered with 304, nothing is downloaded) or by the sha1 of the body.
+    # Without validators the body is hashed in `chunk_size` blocks, and blocks equal to the previous
+    # list's are not scanned: the scan resumes from the scanner saved after the last equal block.
+    # An unchanged list is never scanned again, at the cost of a small scanner copy per block.
+
+    def __init__(self, client, field="status", chunk_size=64 * 1024):
+        self.client = client
+        self.field = field
+        self.chunk_size = chunk_size
+        self.summary = None
+        self._validators = {}
+        # (sha1 of the block, scanner after it) for every block of the last list
+        self._checkpoints = []
+
+    async def fetch(self, url):
+        headers = {}
+        if self.summary is not None:
+            if "ETag" in self._validators:
+                headers["If-None-Match"] = self._validators["ETag"]
+            if "Last-Modified" in self._validators:
+                headers["If-Modified-Since"] = self._validators["Last-Modified"]
+        digest = hashlib.sha1()
+        previous = self._checkpoints
+        checkpoints = []
+        # Scanner of the first block that differs from the previous list, None while all are equal
+        counter = None
+        pending = b""
+        started = time.monotonic()
+        size = 0
+        decode = 0
+
+        def scan(block):
+            nonlocal counter
+            block_digest = hashlib.sha1(block).digest()
+            digest.update(block)
+            index = len(checkpoints)
+            if counter is None:
+                if index < len(previous) and previous[index][0] == block_digest:
+                    checkpoints.append(previous[index])
+                    return
+                counter = checkpoints[-1][1].copy() if checkpoints else StatusCounter(self.field)
+            counter.feed(block)
+            checkpoints.append((block_digest, counter.copy()))
+
+        try:
+            async with self.client.session.get(
+                url, headers=headers, timeout=self.client.request_timeout(url)
+            ) as response:
+                if response.status == 304:
+                    self.client.observe(url, 304, time.monotonic() - started)
+                    return self.summary
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    scanning = time.monotonic()
+                    # Fixed size blocks, so an unchanged body splits the same way every time
+                    pending += chunk
+                    while len(pending) >= self.chunk_size:
+                        scan(pending[: self.chunk_size])
+                        pending = pending[self.chunk_size :]
+                    decode += time.monotonic() - scanning
+                    size += len(chunk)
+                if pending:
+                    scan(pending)
+                self._validators = {k: response.headers[k] for k in ("ETag", "Last-Modified") if k in response.headers}
+        except Exception as e:
+            status = e.status if isinstance(e, aiohttp.ClientResponseError) else type(e).__name__
+            self.client.observe(url, status, time.monotonic() - started)
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            return None
+        # The list is parsed while it streams in, so the transfer time includes the decoding
+        self.client.observe(url, response.status, time.monotonic() - started, size, decode)
+        self._checkpoints = checkpoints
+        if self.summary is not None and self.summary.digest == digest.hexdigest():
+            return self.summary
+        if counter is None:
+            # A prefix of the previous list: its scanner stopped at the last block we got
+            counter = checkpoints[-1][1] if checkpoints else StatusCounter(self.field)
+        self.summary = counter.summary(digest.hexdigest())
+        return self.summary
@@ -0,0 +1,161 @@
+import bisect
+import logging
+import threading
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name + "_total" + format_labels(labels), self.value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield name + "_bucket" + format_labels(labels, [("le", format_value(bound))]), cumulative
+        yield name + "_sum" + format_labels(labels), self.sum
+        yield name + "_count" + format_labels(labels), self.count
+
+
+class Family:
+    # One metric name with a child per combination of label values
+    def __init__(self, name, kind, help, make):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self._make = make
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._make())
+        return child
+
+    def samples(self):
+        for labels, child in list(self._children.items()):
+            yield from child.samples(self.name, labels)
+
+
+class Collected:
+    # A metric read from somewhere else when scraped; `collect` returns {(("label", "value"), ...): value}
+    def __init__(self, name, kind, help, collect):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.collect = collect
+
+    def samples(self):
+        suffix = "_total" if self.kind == "counter" else ""
+        for labels, value in self.collect().items():
+            yield self.name + suffix + format_labels(labels), value
+
+
+class Metrics:
+    # Registry of the bot's counters and histograms, rendered in the prometheus text format.
+    # Updates happen on the event loop or under the GIL and need no locking.
+
+    def __init__(self, prefix="heimdall_"):
+        self.prefix = prefix
+        self._families = []
+
+    def counter(self, name, help):
+        return self._add(Family(self.prefix + name, "counter", help, Counter))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Family(self.prefix + name, "histogram", help, lambda: Histogram(tuple(buckets))))
+
+    def collected(self, name, kind, help, collect):
+        return self._add(Collected(self.prefix + name, kind, help, collect))
+
+    def _add(self, family):
+        self._families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            try:
+                samples = list(family.samples())
+            except Exception as e:
+                logger.warning(f"Collecting {family.name} failed: {e!r}")
+                continue
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(f"{sample} {format_value(value)}" for sample, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    # Serves /metrics for a prometheus scraper, meant to listen on a local address only
+
+    def __init__(self, metrics, listen="127.0.0.1", port=9108):
+        self.metrics = metrics
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def handle(self, request):
+        return web.Response(body=self.metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Metrics on http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, callback, update, context, deadline, on_timeout=None):
+        self.callback = callback
+        self.update = update
+        self.context = context
+        self.deadline = deadline
+        self.on_timeout = on_timeout
+        self.queued_at = time.monotonic()
+
+
+class Pipeline:
+    # Runs coroutine command handlers on one event loop. The dispatcher threads only enqueue updates.
+    # `concurrency` workers take chats round-robin, so one busy group cannot starve the others,
+    # and each chat has at most one command running at a time.
+
+    def __init__(self, concurrency=16, deadline=20, deadlines=None, history=1000):
+        self.concurrency = concurrency
+        self.deadline = deadline
+        # Per-handler overrides of the default deadline, by handler name
+        self.deadlines = dict(deadlines or {})
+        self.loop = None
+        # Blocking calls (telegram's sync api) are run here instead of on the loop
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pipeline")
+        # Called with (update, context) when a handler raises, after context.error is set
+        self.on_error = None
+        # Coroutine function called with (update, context) when a handler misses its deadline
+        self.on_timeout = None
+        # Called with the update before it is queued; returning False discards it
+        self.admit = None
+        # Called with (handler name, seconds since queued, "ok" / "timeout" / "error") after each job
+        self.on_done = None
+        self.history = history
+        self._chats = {}
+        self._ready = None
+        self._workers = []
+        self._running = 0
+        self._latency = {}
+        self._timeouts = {}
+
+    def start(self, loop):
+        # `loop` is a running event loop owned by another thread (the http client's).
+        self.loop = loop
+        asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+
+    async def _start(self):
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+    def handler(self, callback, deadline=None, admit=None, on_timeout=None):
+        # Wrap a coroutine handler into a callback for telegram.ext handlers. `admit` and
+        # `on_timeout` replace the pipeline's own hooks for this handler.
+        def submit(update, context):
+            job = Job(
+                callback, update, context, deadline or self.deadlines.get(callback.__name__, self.deadline), on_timeout
+            )
+            self.loop.call_soon_threadsafe(self._enqueue, job, admit or self.admit)
+
+        submit.__name__ = callback.__name__
+        return submit
+
+    def _enqueue(self, job, admit):
+        if admit is not None and not admit(job.update):
+            return
+        chat_id = job.update.effective_chat.id if job.update.effective_chat else None
+        if chat_id in self._chats:
+            self._chats[chat_id].append(job)
+        else:
+            self._chats[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+
+    async def _work(self):
+        while True:
+            chat_id = await self._ready.get()
+            job = self._chats[chat_id].popleft()
+            self._running += 1
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Whatever a hook raised, the worker must keep serving the other chats
+                logger.exception(f"Running {job.callback.__name__} failed")
+            finally:
+                self._running -= 1
+                if self._chats[chat_id]:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chats[chat_id]
+
+    async def _run(self, job):
+        name = job.callback.__name__
+        outcome = "ok"
+        try:
+            await asyncio.wait_for(job.callback(job.update, job.context), job.deadline)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self._timeouts[name] = self._timeouts.get(name, 0) + 1
+            logger.warning(f"{name} missed its {job.deadline}s deadline.")
+            on_timeout = job.on_timeout or self.on_timeout
+            if on_timeout is not None:
+                # The reply can fail like any telegram call (blocked bot, network error)
+                try:
+                    await on_timeout(job.update, job.context)
+                except Exception as e:
+                    self._error(job, e)
+        except Exception as e:
+            outcome = "error"
+            self._error(job, e)
+        finally:
+            latency = time.monotonic() - job.queued_at
+            self._latency.setdefault(name, deque(maxlen=self.history)).append(latency)
+            if self.on_done is not None:
+                self.on_done(name, latency, outcome)
+
+    def _error(self, job, e):
+        job.context.error = e
+        if self.on_error is not None:
+            self.on_error(job.update, job.context)
+        else:
+            logger.exception(f"Update {job.update} caused error {e}")
+
+    async def run_sync(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def stats(self):
+        commands = {}
+        for name, latencies in list(self._latency.items()):
+            ordered = sorted(latencies)
+            commands[name] = {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+                "timeouts": self._timeouts.get(name, 0),
+            }
+        return {
+            "queued": sum(len(jobs) for jobs in list(self._chats.values())),
+            "running": self._running,
+            "commands": commands,
+        }
+
+    async def drain(self, timeout=30):
+        # Wait until every queued and running job has finished
+        end = time.monotonic() + timeout
+        while (self._chats or self._running) and time.monotonic() < end:
+            await asyncio.sleep(0.1)
+
+    def stop(self, timeout=30):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.drain(timeout), self.loop).result()
+        for worker in self._workers:
+            self.loop.call_soon_threadsafe(worker.cancel)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,87 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_duration(text):
+    # "30s", "2m" or "45" -> seconds, None if it does not look like a duration
+    text = text.lower()
+    scale = 60 if text.endswith("m") else 1
+    text = text.rstrip("sm")
+    if not text.isdigit() or int(text) == 0:
+        return None
+    return int(text) * scale
+
+
+def stack(frame):
+    # "func (file:line)" from the outermost frame in, as flamegraph tools expect
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    # Samples the stacks of every thread at a fixed interval and writes them in the collapsed
+    # format ("thread;outer;...;inner count" per line) that flamegraph.pl and speedscope read.
+    # Only one profile runs at a time.
+
+    def __init__(self, path="profiles", interval=0.005):
+        self.path = path
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, seconds, on_done=None):
+        # Profile for `seconds` in a background thread; `on_done` is called with (path, samples).
+        # Returns False if a profile is already running.
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(seconds, on_done), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def sample(self, seconds):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[f"{names.get(ident, ident)};{stack(frame)}"] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def write(self, stacks):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w") as file:
+            file.writelines(f"{line} {count}\n" for line, count in stacks.most_common())
+        return path
+
+    def _run(self, seconds, on_done):
+        try:
+            stacks = self.sample(seconds)
+            path = self.write(stacks)
+            logger.info(f"Wrote a {seconds}s profile to {path}")
+        except OSError as e:
+            logger.warning(f"Profiling failed: {e!r}")
+            path, stacks = None, Counter()
+        finally:
+            with self._lock:
+                self._thread = None
+        if on_done is not None:
+            on_done(path, sum(stacks.values()))
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        # Seconds until a token is available, 0 if there is one right now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if self.wait_time(now):
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Limiter:
+    # Token buckets for outgoing messages: one global (telegram allows ~30 msg/s per bot), one per
+    # chat and one per user. Users over their budget are dropped; chats and the global budget delay
+    # the reply instead, up to `max_wait` seconds.
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=5, user_rate=0.2, user_burst=3, max_wait=10):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self._chats = {}
+        self._users = {}
+        self.counts = {"sent": 0, "delayed": 0, "dropped": 0, "merged": 0}
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def allow_user(self, user_id):
+        if self._bucket(self._users, user_id, self.user_rate, self.user_burst).take(time.monotonic()):
+            return True
+        self.counts["dropped"] += 1
+        return False
+
+    async def acquire(self, chat_id, max_wait=None):
+        # Wait for both the chat's and the global bucket. Returns False if that would take longer
+        # than `max_wait` (the limiter's own by default).
+        chat = self._bucket(self._chats, chat_id, self.chat_rate, self.chat_burst)
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        delayed = False
+        while True:
+            now = time.monotonic()
+            wait = max(chat.wait_time(now), self.global_bucket.wait_time(now))
+            if not wait:
+                chat.take(now)
+                self.global_bucket.take(now)
+                self.counts["sent"] += 1
+                self.counts["delayed"] += delayed
+                return True
+            if now + wait > deadline:
+                self.counts["dropped"] += 1
+                return False
+            delayed = True
+            await asyncio.sleep(wait)
+
+    def prune(self, idle=600):
+        # Forget buckets that have been full for a while
+        now = time.monotonic()
+        for buckets in (self._chats, self._users):
+            for key, bucket in list(buckets.items()):
+                if now - bucket.updated > idle:
+                    del buckets[key]
+
+    def stats(self):
+        return dict(self.counts, chats=len(self._chats), users=len(self._users))
+
+
+class Coalescer:
+    # Remembers the commands answered recently in each chat, so an identical command arriving
+    # within `window` seconds is merged into the first one instead of being computed again.
+
+    def __init__(self, window=5):
+        self.window = window
+        self._recent = {}
+
+    def is_duplicate(self, chat_id, command):
+        seen = self._recent.get((chat_id, command))
+        return seen is not None and time.monotonic() - seen < self.window
+
+    def remember(self, chat_id, command):
+        # The command is being answered; duplicates within the window are merged into it
+        now = time.monotonic()
+        self._recent[(chat_id, command)] = now
+        if len(self._recent) > 10000:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < self.window}
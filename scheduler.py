@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import random
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple("Snapshot", ["name", "value", "fetched_at"])
+
+
+def freeze(value):
+    # Make a decoded json payload read-only so a published snapshot can be shared by every handler.
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class Refresher:
+    # Polls every registered upstream on its own interval on the given asyncio loop and publishes
+    # the latest good payload as an immutable Snapshot. Failures back off exponentially.
+
+    def __init__(self, fetch, jitter=0.1, max_backoff=600):
+        # `fetch` is the default coroutine function taking a url and returning its payload (None on error).
+        self.fetch = fetch
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.sources = {}
+        self._snapshots = {}
+        self._failures = {}
+        self._tasks = []
+        # Called on the loop with every newly published Snapshot
+        self.listeners = []
+
+    def add(self, name, url, interval, fetch=None):
+        self.sources[name] = (url, interval, fetch or self.fetch)
+
+    def latest(self, name):
+        return self._snapshots.get(name)
+
+    def failures(self, name):
+        # Failed refreshes in a row; while it is not 0 the latest snapshot is stale
+        return self._failures.get(name, 0)
+
+    def _delay(self, interval, failures):
+        delay = min(interval * 2 ** failures, max(interval, self.max_backoff))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _poll(self, name, url, interval, fetch):
+        failures = 0
+        while True:
+            try:
+                value = await fetch(url)
+            except Exception:
+                value = None
+            if value is None:
+                failures += 1
+                self._failures[name] = failures
+                logger.warning(f"Refresh of {name} failed ({failures} in a row).")
+            else:
+                failures = self._failures[name] = 0
+                snapshot = self._snapshots[name] = Snapshot(name, freeze(value), time.time())
+                for listener in self.listeners:
+                    try:
+                        listener(snapshot)
+                    except Exception as e:
+                        logger.warning(f"Listener {listener.__name__} failed on {name}: {e!r}")
+            await asyncio.sleep(self._delay(interval, failures))
+
+    def start(self, loop):
+        # `loop` is a running event loop owned by another thread (the http client's).
+        for name, (url, interval, fetch) in self.sources.items():
+            self._tasks.append(asyncio.run_coroutine_threadsafe(self._poll(name, url, interval, fetch), loop))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def reset(self):
+        # Forget every source, e.g. when the upstream urls change. The last snapshots are kept
+        # so readers have something to serve until the new sources are polled.
+        self.sources = {}
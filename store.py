@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from scheduler import freeze
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path, value):
+    # Write to a temp file next to `path` and rename it over, so readers never see a partial file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(value, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DebouncedWriter:
+    # Batches changes made on any thread and hands them to `write` together, `debounce` seconds
+    # after the first one, on a timer thread. `write` runs under `io_lock`, which readers of the
+    # same file or database take too, so adding a change never waits on a write.
+
+    def __init__(self, write, debounce=5):
+        self.write = write
+        self.debounce = debounce
+        self.io_lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, change):
+        with self._lock:
+            self._pending.append(change)
+            if self._timer is None:
+                self._timer = threading.Timer(self.debounce, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._timer = None
+        if not pending:
+            return
+        with self.io_lock:
+            self.write(pending)
+
+    def close(self):
+        # Write what is still pending right away
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            self.flush()
+
+
+class MarketStore:
+    # Holds the market list as an immutable snapshot that handlers read without locking. Updates
+    # swap in a new snapshot; writing market.json and appending to the sqlite price/volume history
+    # happen later, batched by a DebouncedWriter. History rows come from record(), once per exchange
+    # refresh, so the log grows with the data and not with the commands.
+
+    def __init__(self, path="market.json", db_path="history.db", debounce=5, markets=()):
+        self.path = path
+        self.db_path = db_path
+        self._markets = freeze(list(markets))
+        # Called with the path after market.json has been written
+        self.on_write = None
+        # Changes are ("markets", snapshot) or ("history", row)
+        self._writer = DebouncedWriter(self._write, debounce)
+        self._db = None
+
+    def snapshot(self):
+        return self._markets
+
+    def replace(self, markets):
+        # Take the market list as edited on disk, without writing it back
+        self._markets = freeze(list(markets))
+
+    def update(self, markets):
+        # `markets` is a new list of market dicts; it becomes the current snapshot right away.
+        self._markets = freeze(markets)
+        self._writer.add(("markets", self._markets))
+
+    def record(self, market, price, volume_24h, timestamp=None):
+        # Append one price/volume sample of a market to the history
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        self._writer.add(("history", (timestamp, market["source"], market["pair"], price, volume_24h)))
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS market_history "
+                "(time INTEGER, source TEXT, pair TEXT, price REAL, volume_24h REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS market_history_time ON market_history (source, pair, time)")
+        return self._db
+
+    def _write(self, changes):
+        # Only the latest snapshot is written
+        markets = [value for kind, value in changes if kind == "markets"]
+        rows = [value for kind, value in changes if kind == "history"]
+        try:
+            if markets:
+                atomic_write_json(self.path, [dict(market) for market in markets[-1]])
+                if self.on_write is not None:
+                    self.on_write(self.path)
+            if rows:
+                with self._connect() as db:
+                    db.executemany("INSERT INTO market_history VALUES (?, ?, ?, ?, ?)", rows)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Saving the market state failed: {e!r}")
+
+    def flush(self):
+        self._writer.flush()
+
+    def history(self, source, pair, since):
+        # (time, price, volume_24h) rows of one market since the `since` timestamp, oldest first
+        with self._writer.io_lock:
+            return (
+                self._connect()
+                .execute(
+                    "SELECT time, price, volume_24h FROM market_history "
+                    "WHERE source = ? AND pair = ? AND time >= ? ORDER BY time",
+                    (source, pair, since),
+                )
+                .fetchall()
+            )
+
+    def close(self):
+        self._writer.close()
+        with self._writer.io_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,114 @@
+import json
+import os
+from collections.abc import Mapping
+
+import emission
+from alerts import AlertBook
+from config import ConfigError, load_settings, read_json
+from ratelimit import Coalescer, Limiter
+from store import MarketStore
+from timeseries import DEFAULT_TIERS, TimeSeries
+
+
+class Tenant:
+    # One bot served by the process: its token and admins from auth.json, its links.json,
+    # params.json and market.json, and the state that is its own (market store, history, rate
+    # limits, emission schedule). The http client, pipeline, caches and upstream polling are
+    # shared by every tenant and keyed by url, so tenants with the same upstreams share them.
+
+    def __init__(self, name, directory, auth, settings):
+        self.name = name
+        self.directory = directory
+        self.token = auth["token"]
+        self.webhook_path = auth.get("webhook_path", auth["token"])
+        # Telegram user ids allowed to run admin commands
+        self.admins = frozenset(auth.get("admins", []))
+        self.apply(settings)
+
+        params = self.params
+        self.market_store = MarketStore(
+            self.path("market.json"),
+            self.path("history.db"),
+            debounce=params.get("market_save_delay", 5),
+            markets=settings.markets,
+        )
+        series_params = params.get("timeseries", {})
+        self.series = TimeSeries(
+            self.path(series_params.get("path", "timeseries")), series_params.get("tiers", DEFAULT_TIERS)
+        )
+        limit_params = params.get("rate_limit", {})
+        # Telegram's limits are per bot, so every tenant has its own budget
+        self.limiter = Limiter(
+            global_rate=limit_params.get("global_rate", 30),
+            chat_rate=limit_params.get("chat_rate", 1),
+            chat_burst=limit_params.get("chat_burst", 5),
+            user_rate=limit_params.get("user_rate", 0.2),
+            user_burst=limit_params.get("user_burst", 3),
+            max_wait=limit_params.get("max_wait", 10),
+        )
+        self.coalescer = Coalescer(limit_params.get("coalesce_window", 5))
+        self.alerts = AlertBook(self.path("alerts.db"), debounce=params.get("alerts", {}).get("save_delay", 5))
+        # alerts.Notifier sending with this tenant's bot, set by main() once the bot exists
+        self.notifier = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def apply(self, settings):
+        # Swap in new settings (config.Settings) along with what is derived from them
+        self.settings, self.data, self.params = settings, settings.links, settings.params
+        emission_params = self.params.get("emission", {})
+        self.schedule = emission.Emission(
+            reward=emission_params.get("reward", 20),
+            interval=emission_params.get("halving_interval", 2102400),
+            start_height=emission_params.get("start_height", 8000),
+            start_supply=emission_params.get("start_supply", 80000),
+            offset=emission_params.get("offset", 79980),
+        )
+        self.collateral = emission_params.get("collateral", 10000)
+
+    def source_url(self, name):
+        # Resolve a links.json source name like "masternodes.link" to its url. Anything that
+        # is not a links.json name (e.g. a market api from market.json) is used as-is.
+        value = self.data
+        for part in name.split("."):
+            if not isinstance(value, Mapping) or part not in value:
+                return name
+            value = value[part]
+        return value
+
+    def source_urls(self, name):
+        # The source's url followed by its mirrors from links.json
+        return [self.source_url(name)] + list(self.data.get("mirrors", {}).get(name, ()))
+
+    def ttl(self, name):
+        ttls = self.params.get("cache_ttl", {})
+        return ttls.get(name, ttls.get("default", 30))
+
+    def sources(self):
+        # name -> (url, refresh interval) of everything this tenant has polled
+        intervals = self.params.get("refresh_interval", {})
+        sources = {name: (self.source_url(name), interval) for name, interval in intervals.items() if name != "markets"}
+        if "markets" in intervals:
+            sources.update((market["api"], (market["api"], intervals["markets"])) for market in self.settings.markets)
+        return sources
+
+
+def load_tenant(name, directory="."):
+    try:
+        with open(os.path.join(directory, "auth.json")) as data_file:
+            auth = json.load(data_file)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {os.path.join(directory, 'auth.json')}: {e}")
+    return Tenant(name, directory, auth, load_settings(directory))
+
+
+def load_tenants(path="tenants.json"):
+    # tenants.json lists the bots to run as [{"name": ..., "directory": ...}], each directory with
+    # its own auth.json, links.json, params.json and market.json. Without it the process runs the
+    # single bot configured in the current directory.
+    if not os.path.exists(path):
+        return [load_tenant("default", ".")]
+    entries = read_json(path)
+    base = os.path.dirname(os.path.abspath(path))
+    return [load_tenant(entry["name"], os.path.join(base, entry.get("directory", entry["name"]))) for entry in entries]
@@ -0,0 +1,88 @@
+from alerts import AlertBook, parse_alert
+
+
+def book(tmp_path):
+    return AlertBook(str(tmp_path / "alerts.db"), debounce=60)
+
+
+def ids(alerts):
+    return sorted(alert.id for alert in alerts)
+
+
+def test_parse_alert():
+    assert parse_alert(["price", ">", "0.02"]) == ("price", ">", 0.02)
+    assert parse_alert(["MN<500"]) == ("mn", "<", 500)
+    assert parse_alert(["price", ">", "0.02$"]) == ("price", ">", 0.02)
+    assert parse_alert(["volume", ">", "1"]) is None
+    assert parse_alert(["price", ">", "nan"]) is None
+    assert parse_alert(["price", "=", "1"]) is None
+
+
+def test_crossing_up_fires_only_crossed_thresholds(tmp_path):
+    alerts = book(tmp_path)
+    low = alerts.add(1, "price", ">", 0.02)
+    high = alerts.add(1, "price", ">", 0.03)
+    alerts.add(1, "price", "<", 0.01)
+    alerts.observe("price", 0.015)
+    assert ids(alerts.observe("price", 0.025)) == [low.id]
+    assert alerts.observe("price", 0.029) == []
+    assert ids(alerts.observe("price", 0.04)) == [high.id]
+    assert alerts.stats()["alerts"] == 1
+
+
+def test_crossing_down_fires_only_crossed_thresholds(tmp_path):
+    alerts = book(tmp_path)
+    first = alerts.add(1, "mn", "<", 500)
+    second = alerts.add(2, "mn", "<", 500)
+    third = alerts.add(2, "mn", "<", 400)
+    alerts.add(2, "mn", ">", 450)
+    alerts.observe("mn", 600)
+    assert ids(alerts.observe("mn", 500)) == []
+    assert ids(alerts.observe("mn", 450)) == [first.id, second.id]
+    assert ids(alerts.observe("mn", 300)) == [third.id]
+
+
+def test_alerts_fire_once(tmp_path):
+    alerts = book(tmp_path)
+    alerts.add(1, "mn", "<", 500)
+    alerts.observe("mn", 600)
+    assert len(alerts.observe("mn", 400)) == 1
+    alerts.observe("mn", 600)
+    assert alerts.observe("mn", 400) == []
+
+
+def test_first_observation_fires_alerts_that_hold(tmp_path):
+    alerts = book(tmp_path)
+    below = alerts.add(1, "mn", "<", 500)
+    above = alerts.add(1, "mn", ">", 300)
+    alerts.add(1, "mn", ">", 450)
+    alerts.add(1, "mn", "<", 350)
+    assert ids(alerts.observe("mn", 400)) == [below.id, above.id]
+    assert alerts.observe("mn", 390) == []
+
+
+def test_remove_only_from_own_chat(tmp_path):
+    alerts = book(tmp_path)
+    alert = alerts.add(1, "price", ">", 0.02)
+    assert alerts.remove(alert.id, chat_id=2) is None
+    assert alerts.remove(alert.id, chat_id=1) == alert
+    alerts.observe("price", 0.01)
+    assert alerts.observe("price", 0.03) == []
+
+
+def test_reload_keeps_alerts_digests_and_last_values(tmp_path):
+    alerts = book(tmp_path)
+    kept = alerts.add(1, "price", ">", 0.03)
+    alerts.add(1, "price", ">", 0.02)
+    alerts.set_digest(1, 18)
+    alerts.observe("price", 0.01)
+    alerts.observe("price", 0.025)
+    alerts.close()
+
+    reloaded = book(tmp_path)
+    reloaded.load()
+    assert reloaded.of_chat(1) == [kept]
+    assert reloaded.digests == {1: 18}
+    assert reloaded.values == {"price": 0.025}
+    # A crossing while the bot was down is seen against the stored value
+    assert ids(reloaded.observe("price", 0.04)) == [kept.id]
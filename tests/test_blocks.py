@@ -0,0 +1,66 @@
+from blocks import BlockWindow
+
+
+def blocks(first, last, tag="a"):
+    return [{"height": h, "time": 1000 + 60 * h, "hash": f"{tag}{h}"} for h in range(first, last + 1)]
+
+
+def heights(window):
+    return [window.height(i) for i in range(window.count)]
+
+
+def test_extend_in_any_order():
+    window = BlockWindow(capacity=16)
+    assert window.extend(list(reversed(blocks(1, 5))))
+    assert heights(window) == [1, 2, 3, 4, 5]
+    assert window.extend(blocks(4, 7))
+    assert heights(window) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_extend_with_a_gap_is_refused():
+    window = BlockWindow(capacity=16)
+    window.extend(blocks(1, 5))
+    assert not window.extend(blocks(8, 10))
+    assert heights(window) == [1, 2, 3, 4, 5]
+    assert window.extend(blocks(6, 10))
+    assert window.tip == 10
+
+
+def test_reorg_replaces_the_forked_blocks():
+    window = BlockWindow(capacity=16)
+    window.extend(blocks(1, 10))
+    assert window.extend(blocks(8, 11, tag="b"))
+    assert heights(window) == list(range(1, 12))
+    assert [window.hash(i) for i in range(window.count)] == [f"a{h}" for h in range(1, 8)] + [
+        f"b{h}" for h in range(8, 12)
+    ]
+
+
+def test_shorter_reorg_chain_truncates():
+    window = BlockWindow(capacity=16)
+    window.extend(blocks(1, 10))
+    window.extend(blocks(9, 9, tag="b"))
+    assert window.tip == 9
+    assert window.hash() == "b9"
+
+
+def test_wrap_around_keeps_the_newest_blocks():
+    window = BlockWindow(capacity=8)
+    window.extend(blocks(1, 5))
+    window.extend(blocks(6, 20))
+    assert window.count == 8
+    assert heights(window) == list(range(13, 21))
+    # Blocks older than the window are ignored, a reorg inside it still works after wrapping
+    assert window.extend(blocks(2, 3, tag="b"))
+    assert window.extend(blocks(19, 21, tag="c"))
+    assert heights(window) == list(range(14, 22))
+    assert window.hash(-3) == "c19"
+    assert window.hash(-4) == "a18"
+
+
+def test_averages():
+    window = BlockWindow(capacity=32)
+    window.extend(blocks(1, 21))
+    assert window.avg_block_time(10) == 60
+    assert window.blocks_since(window.time() - 120) == 2
+    assert window.percentile(50, 20) == 60
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from masternodes import StatusCounter
+
+
+def masternodes():
+    return [
+        {"addr": "a", "status": "ENABLED", "note": 'says "status": "EXPIRED"'},
+        {"addr": "b\\", "status": "EXPIRED", "tags": ["status", "ENABLED"]},
+        {"addr": "ü€\U0001f600", "STATUS": "ENABLED", "nested": {"status": "NEW_START_REQUIRED"}},
+        {"addr": "d", "status": "ENABLED", "lastseen": 1, "rank": None},
+        {"addr": "\\u00fc", "status": "PRE_ENABLED"},
+    ]
+
+
+# Only the top-level fields count, not the ones of nested objects or inside strings
+EXPECTED = {"ENABLED": 3, "EXPIRED": 1, "PRE_ENABLED": 1}
+
+
+def count(body, sizes):
+    counter = StatusCounter()
+    position = 0
+    for size in sizes:
+        counter.feed(body[position : position + size])
+        position += size
+    counter.feed(body[position:])
+    return counter.counts
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_counts_statuses_in_one_chunk(ensure_ascii):
+    body = json.dumps(masternodes(), ensure_ascii=ensure_ascii).encode()
+    assert count(body, []) == EXPECTED
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 5, 7, 64])
+def test_counts_are_the_same_for_every_split(chunk):
+    # Splits fall inside strings, escapes and multi-byte UTF-8 sequences
+    body = json.dumps(masternodes(), ensure_ascii=False).encode()
+    assert count(body, [chunk] * (len(body) // chunk)) == EXPECTED
+
+
+def test_every_single_split_point():
+    body = json.dumps(masternodes(), ensure_ascii=False, indent=1).encode()
+    for split in range(len(body)):
+        assert count(body, [split]) == EXPECTED, split
+
+
+def test_statuses_outside_the_list_are_not_counted():
+    body = json.dumps({"status": "ok", "result": masternodes()}).encode()
+    assert count(body, []) == {}
+    body = json.dumps([[{"status": "ENABLED"}], {"status": "ENABLED", "list": [{"status": "EXPIRED"}]}]).encode()
+    assert count(body, []) == {"ENABLED": 1}
+
+
+def test_copy_resumes_where_it_stopped():
+    body = json.dumps(masternodes(), ensure_ascii=False).encode()
+    for split in range(1, len(body)):
+        counter = StatusCounter()
+        counter.feed(body[:split])
+        resumed = counter.copy()
+        counter.feed(b'"status": "BOGUS"')
+        resumed.feed(body[split:])
+        assert resumed.counts == EXPECTED, split
+
+
+def test_summary():
+    counter = StatusCounter()
+    counter.feed(json.dumps(masternodes()).encode())
+    summary = counter.summary(digest="abc")
+    assert (summary.total, summary.enabled, summary.digest) == (5, 3, "abc")
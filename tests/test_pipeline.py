@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+from pipeline import Pipeline
+
+
+def update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+def run(pipeline, jobs, timeout=5):
+    # Queue (callback, update) jobs on a fresh loop and wait for all of them
+    async def main():
+        await pipeline._start()
+        for callback, job_update in jobs:
+            pipeline.handler(callback)(job_update, SimpleNamespace())
+        await asyncio.sleep(0)
+        await pipeline.drain(timeout)
+        for worker in pipeline._workers:
+            worker.cancel()
+
+    loop = asyncio.new_event_loop()
+    pipeline.loop = loop
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+        pipeline.executor.shutdown(wait=False)
+
+
+def test_failing_timeout_replies_do_not_stop_the_workers():
+    answered = []
+    errors = []
+    outcomes = []
+
+    async def slow(update, context):
+        await asyncio.sleep(10)
+
+    async def coin(update, context):
+        answered.append(update.effective_chat.id)
+
+    async def missed(update, context):
+        raise RuntimeError("Forbidden: bot was blocked by the user")
+
+    pipeline = Pipeline(concurrency=2, deadline=0.05)
+    pipeline.on_timeout = missed
+    pipeline.on_error = lambda update, context: errors.append(context.error)
+    pipeline.on_done = lambda name, latency, outcome: outcomes.append((name, outcome))
+    run(pipeline, [(slow, update(1)), (slow, update(2)), (coin, update(3)), (coin, update(1))])
+
+    assert sorted(answered) == [1, 3]
+    assert [str(e) for e in errors] == ["Forbidden: bot was blocked by the user"] * 2
+    assert sorted(outcomes) == [("coin", "ok"), ("coin", "ok"), ("slow", "timeout"), ("slow", "timeout")]
+    assert pipeline.stats()["commands"]["slow"]["timeouts"] == 2
+    assert not pipeline._chats and pipeline._running == 0
+
+
+def test_timeout_replies_are_sent():
+    replied = []
+
+    async def slow(update, context):
+        await asyncio.sleep(10)
+
+    async def missed(update, context):
+        replied.append(update.effective_chat.id)
+
+    pipeline = Pipeline(concurrency=1, deadline=0.05)
+    run(pipeline, [(slow, update(1))])
+    assert replied == []
+    pipeline = Pipeline(concurrency=1, deadline=0.05)
+    pipeline.on_timeout = missed
+    run(pipeline, [(slow, update(1)), (slow, update(1))])
+    assert replied == [1, 1]
+
+
+def test_worker_survives_a_failing_hook():
+    answered = []
+
+    async def coin(update, context):
+        answered.append(update.effective_chat.id)
+
+    def on_done(name, latency, outcome):
+        if len(answered) == 1:
+            raise RuntimeError("metrics broke")
+
+    pipeline = Pipeline(concurrency=1)
+    pipeline.on_done = on_done
+    run(pipeline, [(coin, update(1)), (coin, update(2))])
+    assert answered == [1, 2]
@@ -0,0 +1,59 @@
+import json
+
+from store import DebouncedWriter, MarketStore
+
+MARKET = {"source": "stex", "pair": "XSG/BTC", "api": "https://example.com/stex"}
+
+
+def store(tmp_path, debounce=60):
+    return MarketStore(str(tmp_path / "market.json"), str(tmp_path / "history.db"), debounce, [MARKET])
+
+
+def test_writer_batches_changes_until_flushed():
+    batches = []
+    writer = DebouncedWriter(batches.append, debounce=60)
+    writer.add(1)
+    writer.add(2)
+    assert batches == []
+    writer.flush()
+    writer.flush()
+    writer.add(3)
+    writer.close()
+    writer.close()
+    assert batches == [[1, 2], [3]]
+
+
+def test_writer_writes_after_the_delay():
+    batches = []
+    writer = DebouncedWriter(batches.append, debounce=0.01)
+    writer.add(1)
+    writer._timer.join()
+    assert batches == [[1]]
+
+
+def test_snapshot_changes_right_away_and_is_written_later(tmp_path):
+    markets = store(tmp_path)
+    written = []
+    markets.on_write = written.append
+    markets.update([dict(MARKET, price=1)])
+    markets.update([dict(MARKET, price=2)])
+    assert markets.snapshot()[0]["price"] == 2
+    assert not (tmp_path / "market.json").exists()
+    markets.flush()
+    assert json.loads((tmp_path / "market.json").read_text()) == [dict(MARKET, price=2)]
+    assert written == [str(tmp_path / "market.json")]
+    markets.close()
+
+
+def test_recorded_history_and_replace_do_not_rewrite_the_list(tmp_path):
+    markets = store(tmp_path)
+    markets.record(MARKET, 0.02, 1000, timestamp=10)
+    markets.record(MARKET, 0.03, 1500, timestamp=20)
+    markets.replace([dict(MARKET, price=3)])
+    markets.close()
+    assert not (tmp_path / "market.json").exists()
+
+    reopened = store(tmp_path)
+    assert reopened.history("stex", "XSG/BTC", 15) == [(20, 0.03, 1500)]
+    assert reopened.history("stex", "XSG/BTC", 0) == [(10, 0.02, 1000), (20, 0.03, 1500)]
+    reopened.close()
@@ -0,0 +1,58 @@
+import numpy as np
+
+from timeseries import TimeSeries, parse_period
+
+TIERS = ((60, 3600), (900, 86400))
+
+
+def test_parse_period():
+    assert parse_period("24h") == 86400
+    assert parse_period("2W") == 1209600
+    assert parse_period("0d") is None
+    assert parse_period("week") is None
+
+
+def test_closed_buckets_are_averaged():
+    series = TimeSeries(tiers=TIERS)
+    for timestamp, price in [(0, 1.0), (30, 3.0), (60, 5.0), (130, 7.0)]:
+        series.record(timestamp, price=price)
+    times, values = series.query("price", 3600, now=130)
+    assert times.tolist() == [0, 60, 120]
+    assert values.tolist() == [2.0, 5.0, 7.0]
+
+
+def test_current_bucket_is_queried():
+    series = TimeSeries(tiers=TIERS)
+    series.record(1000, price=1.0, volume=5.0)
+    series.record(1010, price=2.0)
+    times, values = series.query("price", 86400, now=1010)
+    assert times.tolist() == [900] and values.tolist() == [1.5]
+    assert series.query("volume", 3600, now=1010)[1].tolist() == [5.0]
+    assert series.query("hashrate", 3600, now=1010)[1].tolist() == []
+
+
+def test_summary_includes_the_current_bucket():
+    series = TimeSeries()
+    series.record(price=0.02)
+    summary = series.summary("price", 7 * 86400)
+    assert summary["last"] == summary["first"] == 0.02
+
+
+def test_current_bucket_survives_a_restart(tmp_path):
+    series = TimeSeries(str(tmp_path), tiers=TIERS)
+    series.record(0, price=1.0)
+    series.record(60, price=2.0)
+    series.record(90, price=4.0)
+    series.write(series.export())
+
+    reloaded = TimeSeries(str(tmp_path), tiers=TIERS)
+    reloaded.load()
+    assert reloaded.query("price", 3600, now=90)[1].tolist() == [1.0, 3.0]
+    # The reopened bucket keeps averaging, then closes as usual
+    reloaded.record(100, price=6.0)
+    reloaded.record(130, price=9.0)
+    times, values = reloaded.query("price", 3600, now=130)
+    assert times.tolist() == [0, 60, 120]
+    assert values.tolist() == [1.0, 4.5, 9.0]
+    assert [len(records) for records in reloaded.export()] == [3, 1]
+    assert np.isnan(reloaded.export()[0]["volume"]).all()
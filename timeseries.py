@@ -0,0 +1,164 @@
+import logging
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("price", "volume", "hashrate", "difficulty", "masternodes")
+RECORD = np.dtype([("time", "i8")] + [(field, "f8") for field in FIELDS])
+SPARKS = "▁▂▃▄▅▆▇█"
+UNITS = {"h": 3600, "d": 86400, "w": 604800, "m": 2592000, "y": 31536000}
+# (resolution, retention) in seconds: 1 minute records for two days, 15 minutes for a month, 3 hours for two years
+DEFAULT_TIERS = ((60, 172800), (900, 2592000), (10800, 63072000))
+
+
+def parse_period(text):
+    # "24h", "7d", "2w", "3m", "1y" -> seconds, None if it does not look like a period
+    match = re.fullmatch(r"(\d+)([hdwmy])", text.lower())
+    if match is None or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+class Tier:
+    # Fixed-width records at one resolution, oldest first. Samples are averaged into the current
+    # bucket, which is appended once a sample for a later bucket arrives. Until then records()
+    # includes it with its average so far, and the last loaded record is reopened as the current
+    # bucket, so a partial bucket saved before a restart keeps filling up.
+
+    def __init__(self, resolution, retention):
+        self.resolution = resolution
+        self.slots = max(1, retention // resolution)
+        self.data = np.zeros(2 * self.slots, dtype=RECORD)
+        self.count = 0
+        self._bucket = None
+        self._sum = np.zeros(len(FIELDS))
+        self._samples = np.zeros(len(FIELDS))
+
+    def view(self):
+        return self.data[: self.count]
+
+    def load(self, records):
+        records = records[-self.slots :]
+        self.data[: len(records)] = records
+        self.count = len(records)
+        if self.count:
+            self.count -= 1
+            last = self.data[self.count]
+            values = np.array([last[field] for field in FIELDS])
+            self._bucket = int(last["time"]) // self.resolution
+            self._samples = (~np.isnan(values)).astype("f8")
+            self._sum = np.where(self._samples > 0, values, 0.0)
+
+    def _current(self):
+        values = np.where(self._samples > 0, self._sum / np.maximum(self._samples, 1), np.nan)
+        return (self._bucket * self.resolution, *values)
+
+    def records(self):
+        # The closed records followed by the current bucket, if it has samples
+        if self._bucket is None or not self._samples.any():
+            return self.view()
+        return np.append(self.view(), np.array([self._current()], dtype=RECORD))
+
+    def _append(self, record):
+        if self.count == len(self.data):
+            # Keep the newest `slots` records; moving them happens once every `slots` appends
+            self.data[: self.slots] = self.data[self.count - self.slots : self.count]
+            self.count = self.slots
+        self.data[self.count] = record
+        self.count += 1
+
+    def _close_bucket(self):
+        self._append(self._current())
+        self._sum[:] = 0
+        self._samples[:] = 0
+
+    def add(self, timestamp, values):
+        bucket = timestamp // self.resolution
+        if self.count and bucket * self.resolution <= self.data[self.count - 1]["time"]:
+            return
+        if self._bucket is not None and bucket != self._bucket:
+            self._close_bucket()
+        self._bucket = bucket
+        known = ~np.isnan(values)
+        self._sum[known] += values[known]
+        self._samples += known
+
+
+class TimeSeries:
+    # Price, volume, hashrate, difficulty and masternode history in downsampling tiers.
+
+    def __init__(self, path="timeseries", tiers=DEFAULT_TIERS):
+        self.path = path
+        self.tiers = [Tier(resolution, retention) for resolution, retention in tiers]
+
+    def _file(self, tier):
+        return os.path.join(self.path, f"tier_{tier.resolution}.npy")
+
+    def load(self):
+        for tier in self.tiers:
+            try:
+                tier.load(np.load(self._file(tier)).astype(RECORD))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning(f"Loading {self._file(tier)} failed: {e!r}")
+
+    def export(self):
+        # Copies of the records, current buckets included, safe to write from another thread
+        return [tier.records().copy() for tier in self.tiers]
+
+    def write(self, tiers):
+        os.makedirs(self.path, exist_ok=True)
+        for tier, records in zip(self.tiers, tiers):
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                np.save(file, records)
+            os.replace(tmp_path, self._file(tier))
+
+    def record(self, timestamp=None, **values):
+        # Add one sample; fields that are not given are stored as missing
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        sample = np.array([values.get(field, np.nan) for field in FIELDS], dtype="f8")
+        for tier in self.tiers:
+            tier.add(timestamp, sample)
+
+    def query(self, field, seconds, now=None):
+        # (times, values) of `field` over the last `seconds`, from the finest tier that reaches back that far
+        now = time.time() if now is None else now
+        since = now - seconds
+        tier = next((t for t in self.tiers if t.slots * t.resolution >= seconds), self.tiers[-1])
+        records = tier.records()
+        records = records[np.searchsorted(records["time"], since) :]
+        values = records[field]
+        known = ~np.isnan(values)
+        return records["time"][known], values[known]
+
+    def summary(self, field, seconds, width=24):
+        times, values = self.query(field, seconds)
+        if not len(values):
+            return None
+        return {
+            "min": values.min(),
+            "max": values.max(),
+            "avg": values.mean(),
+            "first": values[0],
+            "last": values[-1],
+            "change": (values[-1] - values[0]) / values[0] * 100 if values[0] else 0.0,
+            "since": int(times[0]),
+            "spark": sparkline(values, width),
+        }
+
+
+def sparkline(values, width=24):
+    if len(values) > width:
+        values = np.array([chunk.mean() for chunk in np.array_split(values, width)])
+    low, high = values.min(), values.max()
+    if high - low <= abs(high) * 1e-9:
+        return SPARKS[len(SPARKS) // 2] * len(values)
+    levels = ((values - low) / (high - low) * (len(SPARKS) - 1)).round().astype(int)
+    return "".join(SPARKS[level] for level in levels)
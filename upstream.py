@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    # Closed: requests go through. After `threshold` failures in a row it opens and fails fast for
+    # `cooldown` seconds, then lets a single trial request through; its result closes or reopens it.
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._trial or time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self._trial and time.monotonic() - self.opened_at >= self.cooldown:
+            self._trial = True
+            return True
+        return False
+
+    def release(self):
+        # The trial request was abandoned without a result
+        self._trial = False
+
+    def record(self, ok):
+        self._trial = False
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit opened after {self.failures} failures in a row.")
+            self.opened_at = time.monotonic()
+
+
+class Upstreams:
+    # Fetches a source from its url and mirrors, with a circuit breaker per url. Mirrors are hedged:
+    # a backup request goes to the next healthy url when the current one fails or has not answered
+    # within `hedge_after` seconds, and the first good reply wins.
+
+    def __init__(self, threshold=5, cooldown=30, hedge_after=1.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.breakers = {}
+
+    def breaker(self, url):
+        breaker = self.breakers.get(url)
+        if breaker is None:
+            breaker = self.breakers[url] = CircuitBreaker(self.threshold, self.cooldown)
+        return breaker
+
+    async def _call(self, fetch, url):
+        breaker = self.breaker(url)
+        try:
+            value = await fetch(url)
+        except asyncio.CancelledError:
+            # Lost the race to another mirror, which says nothing about this one
+            breaker.release()
+            raise
+        except Exception as e:
+            logger.warning(f"Fetching {url} failed: {e!r}")
+            value = None
+        breaker.record(value is not None)
+        return value
+
+    async def fetch(self, fetch, urls, hedge_after=None):
+        # `fetch` is a coroutine function taking a url; None when every url failed or is open
+        hedge_after = self.hedge_after if hedge_after is None else hedge_after
+        # Open breakers are skipped when their turn comes, so a cooled down one is only tried when needed
+        healthy = (url for url in urls if self.breaker(url).allow())
+        pending = set()
+        try:
+            while True:
+                url = next(healthy, None)
+                if url is not None:
+                    pending.add(asyncio.ensure_future(self._call(fetch, url)))
+                if not pending:
+                    return None
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge_after if url is not None else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.result() is not None:
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {url: breaker.state for url, breaker in self.breakers.items()}
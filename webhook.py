@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    # Receives telegram updates over https POSTs on a secret path per bot and feeds them straight to
+    # that bot's dispatcher, whose handlers enqueue them on the pipeline.
+
+    def __init__(self, listen="0.0.0.0", port=8443, max_connections=40):
+        # path -> (bot, dispatcher)
+        self.routes = {}
+        self.listen = listen
+        self.port = port
+        self.max_connections = max_connections
+        self._runner = None
+        self._site = None
+        self._slots = None
+
+    def add(self, path, bot, dispatcher):
+        self.routes["/" + path.strip("/")] = (bot, dispatcher)
+
+    async def handle(self, request):
+        bot, dispatcher = self.routes[request.path]
+        async with self._slots:
+            try:
+                payload = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            update = Update.de_json(payload, bot)
+            try:
+                dispatcher.process_update(update)
+            except Exception as e:
+                logger.warning(f"Update {payload} caused error {e!r}")
+        return web.Response()
+
+    def app(self):
+        app = web.Application()
+        for path in self.routes:
+            app.router.add_post(path, self.handle)
+        return app
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        self._site = web.TCPSite(self._runner, self.listen, self.port, backlog=self.max_connections)
+        await self._site.start()
+        logger.info(f"Webhook listening on {self.listen}:{self.port}")
+
+    async def stop(self, pipeline=None, timeout=30):
+        # Stop accepting updates, let the in-flight requests finish, then drain the pipeline.
+        if self._runner is None:
+            return
+        await self._site.stop()
+        await self._runner.cleanup()
+        if pipeline is not None:
+            await pipeline.drain(timeout)
+        self._runner = None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Replays recorded telegram updates against a running webhook server, e.g.
+#   python webhook_replay.py http://127.0.0.1:8443/<webhook_path> fixtures/updates.json --repeat 100
+
+import argparse
+import asyncio
+import copy
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+
+def updates_for(recorded, repeat, chats):
+    # Renumber update ids and spread the messages over `chats` chats so every post is a new update
+    update_id = 0
+    for _ in range(repeat):
+        for update in recorded:
+            update = copy.deepcopy(update)
+            update_id += 1
+            update["update_id"] = update_id
+            message = update.get("message")
+            if message is not None and chats:
+                message["chat"]["id"] = -1_000_000_000_000 - (update_id % chats)
+                message["message_id"] = update_id
+            yield update
+
+
+async def replay(url, updates, concurrency):
+    statuses = Counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def post(session, update):
+        async with slots:
+            try:
+                async with session.post(url, json=update) as response:
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+
+    async with aiohttp.ClientSession() as session:
+        start = time.monotonic()
+        await asyncio.gather(*[post(session, update) for update in updates])
+        elapsed = time.monotonic() - start
+    return statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post recorded telegram updates to a webhook")
+    parser.add_argument("url")
+    parser.add_argument("updates", help="json file with a list of recorded updates")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--chats", type=int, default=0, help="spread the updates over this many chats")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.updates) as data_file:
+        recorded = json.load(data_file)
+    updates = list(updates_for(recorded, args.repeat, args.chats))
+    statuses, elapsed = asyncio.run(replay(args.url, updates, args.concurrency))
+    print(f"Posted {len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.1f} updates/s)")
+    print(f"Responses: {dict(statuses)}")
+
+
+if __name__ == "__main__":
+    main()